@@ -0,0 +1,17 @@
+import streamlit as st
+
+from registry.storage import Registry
+
+
+# One registry per server process, shared by all sessions and pages and kept up to date on save
+@st.cache_resource
+def get_registry():
+    return Registry()
+
+
+# Search indexes of the registry, rebuilt only when its epoch or generation changes
+@st.cache_resource(max_entries=2)
+def get_search_index(epoch, generation):
+    from registry.search import build_index
+
+    return build_index(get_registry())
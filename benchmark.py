@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from registry import storage
+from registry.schema import SCHEMA, TOXICITY_COLUMNS
+from registry.storage import Registry, load_data, record_visits, save_data, transaction
+
+# Benchmark of the registry data path on synthetic registries. Each size gets a
+# fresh database in a temporary directory; the report is written as JSON so
+# runs can be compared before deployment.
+SIZES = [1_000, 10_000, 100_000]
+report_file = "benchmark.json"
+
+
+def _date(rng, start, days):
+    return (start + timedelta(days=rng.randrange(days))).strftime("%Y-%m-%d")
+
+
+def _pick(rng, column, k=1):
+    return rng.sample(SCHEMA[column].options, k)
+
+
+# One synthetic patient: a baseline visit with demographics, pathology and
+# treatment, then follow-up visits that update toxicities and outcomes
+def synthetic_patient(rng, mrn, visits):
+    radiotherapy = date(2015, 1, 1) + timedelta(days=rng.randrange(3000))
+    baseline = {
+        "MRN": mrn,
+        "Date_of_Birth": _date(rng, date(1930, 1, 1), 25000),
+        "Date_of_Last_Radiotherapy": radiotherapy.strftime("%Y-%m-%d"),
+        "Histology": _pick(rng, "Histology", rng.choice([1, 1, 1, 2])),
+        "Grade": _pick(rng, "Grade")[0],
+        "Necrosis": _pick(rng, "Necrosis")[0],
+        "LVI": _pick(rng, "LVI")[0],
+        "Mytotic_Count": rng.randrange(40),
+        "Location": _pick(rng, "Location")[0],
+        "Clinical_Stage_Extremity": _pick(rng, "Clinical_Stage_Extremity"),
+        "Clinical_Stage_Retroperitoneum": _pick(rng, "Clinical_Stage_Retroperitoneum"),
+        "Biopsy_date": (radiotherapy - timedelta(days=rng.randrange(30, 120))).strftime("%Y-%m-%d"),
+        "Recurrent_Tumor": "No",
+        "Systemic_Treatment": _pick(rng, "Systemic_Treatment"),
+        "Dose_per_Fraction": rng.choice([2, 2, 2, 5]),
+        "Fractionation": rng.choice([25, 28, 5]),
+    }
+    rows = []
+    for number in range(visits):
+        follow_up = radiotherapy + timedelta(days=90 * (number + 1) + rng.randrange(30))
+        visit = dict(baseline) if number == 0 else {"MRN": mrn}
+        visit["Follow_up_date"] = follow_up.strftime("%Y-%m-%d")
+        for column in TOXICITY_COLUMNS:
+            options = SCHEMA[column].options
+            visit[column] = options[0] if rng.random() < 0.8 else rng.choice(options)
+        for column in ["Local_Recurrence", "Regional_Recurrence", "Distant_Recurrence", "Death"]:
+            visit[column] = "Yes" if number == visits - 1 and rng.random() < 0.1 else "No"
+            if visit[column] == "Yes":
+                visit[f"{column}_date"] = visit["Follow_up_date"]
+        rows.append(visit)
+    return rows
+
+
+# Synthetic visits, `size` in total, spread over patients with one to six visits
+def synthetic_registry(size, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    while len(rows) < size:
+        mrn = str(1_000_000 + len(rows))
+        rows.extend(synthetic_patient(rng, mrn, min(rng.randint(1, 6), size - len(rows))))
+    return rows
+
+
+def _timings(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return {"median": statistics.median(seconds), "min": min(seconds), "max": max(seconds), "runs": repeat}
+
+
+# Full script runs of the Streamlit app: a cold first run, then reruns with an
+# MRN entered, which is what a coordinator's session does
+def _app_timings(mrn, repeat):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    st.cache_resource.clear()
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py"),
+        default_timeout=120)
+    started = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - started
+    app.text_input(key="mrn").set_value(mrn).run()
+    result = _timings(app.run, repeat)
+    result["first_run"] = first_run
+    return result
+
+
+def benchmark_size(size, repeat=5, app=True, seed=0):
+    rows = synthetic_registry(size, seed)
+    mrns = sorted({row["MRN"] for row in rows})
+    rng = random.Random(seed)
+    result = {"visits": size, "patients": len(mrns)}
+
+    started = time.perf_counter()
+    with transaction() as conn:
+        record_visits(conn, rows)
+    result["populate_seconds"] = time.perf_counter() - started
+
+    result["load_data"] = _timings(load_data, min(repeat, 3))
+    started = time.perf_counter()
+    registry = Registry().refresh()
+    result["registry_warm_up_seconds"] = time.perf_counter() - started
+    result["get_patient_data"] = _timings(lambda: registry.current(rng.choice(mrns)), repeat * 100)
+    result["save_data"] = _timings(lambda: save_data(dict(rng.choice(rows))), repeat)
+    result["registry_append"] = _timings(lambda: registry.append(dict(rng.choice(rows))), repeat)
+    if app:
+        result["app_rerun"] = _app_timings(rng.choice(mrns), repeat)
+    return result
+
+
+def run(sizes=None, repeat=5, app=True, seed=0):
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    cwd = os.getcwd()
+    for size in sizes or SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                report["results"].append(benchmark_size(size, repeat, app, seed))
+            finally:
+                os.chdir(cwd)
+                storage._writers.clear()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the registry data path on synthetic registries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="number of visits per registry")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-app", action="store_true", help="skip the Streamlit AppTest reruns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=report_file)
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, not args.no_app, args.seed)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for result in report["results"]:
+        line = (
+            f"{result['visits']:>7} visits: load_data {result['load_data']['median'] * 1000:.0f} ms, "
+            f"get_patient_data {result['get_patient_data']['median'] * 1e6:.0f} us, "
+            f"save_data {result['save_data']['median'] * 1000:.1f} ms"
+        )
+        if "app_rerun" in result:
+            line += f", app rerun {result['app_rerun']['median'] * 1000:.0f} ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
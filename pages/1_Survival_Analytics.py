@@ -0,0 +1,49 @@
+import altair as alt
+import streamlit as st
+
+from app_cache import get_registry
+from registry.schema import LOCATION_OPTIONS
+from registry.survival import ENDPOINTS, STRATA_COLUMNS, survival_curves
+
+
+# Curves are cached per filter and registry version (epoch and generation, so
+# rewritten visits invalidate them too); switching strata or endpoints only
+# computes each combination once per version
+@st.cache_data(max_entries=256)
+def cached_curves(epoch, generation, endpoint, stratify_by, estimator, locations):
+    current = get_registry().current_frame(encoded=True)
+    if locations:
+        current = current[current["Location"].isin(locations)]
+    return survival_curves(current, endpoint, stratify_by, estimator)
+
+
+st.title("Survival Analytics")
+
+registry = get_registry()
+registry.refresh()
+
+endpoint = st.selectbox("Endpoint", list(ENDPOINTS))
+estimators = ["Kaplan-Meier"] if endpoint == "Overall survival" else ["Kaplan-Meier", "Cumulative incidence"]
+estimator = st.radio("Estimator", estimators, horizontal=True,
+    help="Cumulative incidence treats death without the recurrence as a competing event.")
+stratify_by = st.selectbox("Stratify by", STRATA_COLUMNS, index=None, placeholder="No stratification")
+locations = st.multiselect("Location", LOCATION_OPTIONS, placeholder="All locations")
+
+curves = cached_curves(registry.epoch, registry.generation, endpoint, stratify_by, estimator, tuple(locations))
+
+if curves.empty:
+    st.info("No patients with follow-up for this selection yet.")
+else:
+    title = "Survival probability" if estimator == "Kaplan-Meier" else "Cumulative incidence"
+    chart = alt.Chart(curves).mark_line(interpolate="step-after").encode(
+        x=alt.X("time:Q", title="Months since last radiotherapy"),
+        y=alt.Y("estimate:Q", title=title, scale=alt.Scale(domain=[0, 1])),
+        color=alt.Color("stratum:N", title=stratify_by or ""),
+        tooltip=["stratum", "time", "at_risk", "events", alt.Tooltip("estimate:Q", format=".3f")],
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+    summary = curves.groupby("stratum").agg(
+        patients=("at_risk", "first"), events=("events", "sum"), estimate=("estimate", "last")
+    )
+    st.dataframe(summary.rename(columns={"estimate": f"final {title.lower()}"}))
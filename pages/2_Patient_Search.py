@@ -0,0 +1,45 @@
+import time
+
+import streamlit as st
+
+from app_cache import get_registry, get_search_index
+from registry.search import DATE_INDEXED_COLUMNS
+
+RECURRENCE_COLUMNS = {"Local": "Local_Recurrence", "Regional": "Regional_Recurrence", "Distant": "Distant_Recurrence"}
+DATE_LABELS = {"Biopsy_date": "Biopsy", "Surgery_date": "Surgery", "Date_of_Last_Radiotherapy": "Last radiotherapy"}
+
+st.title("Patient Search")
+
+registry = get_registry().refresh()
+index = get_search_index(registry.epoch, registry.generation)
+
+mrn_prefix = st.text_input("MRN starts with")
+if mrn_prefix:
+    st.caption("Matching MRNs: " + (", ".join(index.complete(mrn_prefix)) or "none"))
+
+filters = {}
+columns = st.columns(3)
+filters["Histology"] = columns[0].multiselect("Histology", list(index.options("Histology")), placeholder="Any")
+filters["Location"] = columns[1].multiselect("Location", list(index.options("Location")), placeholder="Any")
+filters["Grade"] = columns[2].multiselect("Grade", list(index.options("Grade")), placeholder="Any")
+
+recurrences = st.multiselect("Recurrence", list(RECURRENCE_COLUMNS), placeholder="Any",
+    help="Patients with a recurrence of every selected kind")
+for recurrence in recurrences:
+    filters[RECURRENCE_COLUMNS[recurrence]] = ["Yes"]
+
+dates = {}
+columns = st.columns(len(DATE_INDEXED_COLUMNS))
+for column, date_column in zip(columns, DATE_INDEXED_COLUMNS):
+    window = column.date_input(DATE_LABELS[date_column], value=(), format="YYYY-MM-DD", key=f"search_{date_column}")
+    if window:
+        dates[date_column] = (window[0], window[1] if len(window) > 1 else None)
+
+started = time.perf_counter()
+results = index.search(mrn_prefix, filters, dates)
+elapsed = time.perf_counter() - started
+
+st.caption(f"{len(results)} of {index.size} patients in {elapsed * 1000:.1f} ms")
+st.dataframe(results.head(1000), hide_index=True)
+if len(results) > 1000:
+    st.caption("Showing the first 1000 patients; narrow the search to see the rest.")
@@ -0,0 +1,41 @@
+import io
+
+import streamlit as st
+
+from registry.export import FORMATS, export, redcap_dictionary
+from registry.schema import DATE_COLUMNS, HISTOLOGY_OPTIONS, LOCATION_OPTIONS, REGISTRY_COLUMNS
+
+FORMAT_LABELS = {"csv": "CSV", "redcap": "REDCap import", "parquet": "Parquet"}
+EXTENSIONS = {"csv": "csv", "redcap": "csv", "parquet": "parquet"}
+
+st.title("Export")
+
+format = st.radio("Format", FORMATS, format_func=FORMAT_LABELS.get, horizontal=True)
+current = st.toggle("One row per patient (current state)", help="Otherwise every visit is exported.")
+columns = st.multiselect("Columns", REGISTRY_COLUMNS, placeholder="All columns")
+
+with st.expander("Filters"):
+    date_column = st.selectbox("Date", DATE_COLUMNS, index=DATE_COLUMNS.index("Follow_up_date"))
+    window = st.date_input("Between", value=(), format="YYYY-MM-DD")
+    locations = st.multiselect("Location", LOCATION_OPTIONS, placeholder="All locations")
+    histologies = st.multiselect("Histology", HISTOLOGY_OPTIONS, placeholder="All histologies")
+    since = st.number_input("Only visits after visit id", min_value=0, step=1,
+        help="The watermark of an earlier export, to export only what was added since.")
+
+if st.button("Prepare export"):
+    buffer = io.BytesIO()
+    report = export(
+        buffer, format, columns or None, since, current,
+        date_column=date_column, start=window[0] if window else None,
+        end=window[1] if len(window) > 1 else None, locations=locations, histologies=histologies,
+    )
+    st.session_state.export = (buffer.getvalue(), format, report)
+
+if "export" in st.session_state:
+    data, prepared_format, report = st.session_state.export
+    st.caption(f"{report['rows']} rows. Watermark for the next incremental export: {report['watermark']}")
+    st.download_button("Download", data, file_name=f"registry.{EXTENSIONS[prepared_format]}")
+    if prepared_format == "redcap":
+        dictionary = io.StringIO()
+        redcap_dictionary(dictionary, columns or None)
+        st.download_button("Download data dictionary", dictionary.getvalue(), file_name="registry_dictionary.csv")
@@ -0,0 +1,32 @@
+import streamlit as st
+
+from app_cache import get_registry
+from registry.rules import RULES, check_registry
+
+
+# Violations are recomputed only when the registry has new or rewritten visits
+@st.cache_data(max_entries=4)
+def cached_violations(epoch, generation):
+    return check_registry(get_registry())
+
+
+st.title("Data Quality")
+
+registry = get_registry().refresh()
+violations = cached_violations(registry.epoch, registry.generation)
+
+messages = {rule.name: rule.message for rule in RULES}
+counts = violations.groupby("rule").agg(visits=("visit_id", "size"), patients=("MRN", "nunique"))
+summary = counts.reindex(list(messages), fill_value=0).assign(check=list(messages.values()))
+
+st.caption(f"{len(violations)} violations in {len(registry.visit_ids)} visits")
+st.dataframe(summary[["check", "visits", "patients"]], column_config={"rule": None})
+
+rules = st.multiselect("Rules", list(messages), format_func=messages.get, placeholder="All rules")
+mrn = st.text_input("MRN")
+shown = violations
+if rules:
+    shown = shown[shown["rule"].isin(rules)]
+if mrn:
+    shown = shown[shown["MRN"] == mrn.strip()]
+st.dataframe(shown[["visit_id", "MRN", "message"]], hide_index=True)
@@ -0,0 +1,49 @@
+import streamlit as st
+
+from registry.schema import LOCATION_OPTIONS, SCHEMA, TOXICITY_COLUMNS, TOXICITY_SEVERITY
+from registry.storage import load_toxicity_counts
+
+# Toxicities recorded only as present or absent, summarized apart from the graded ones
+PRESENCE_TOXICITIES = [column for column in TOXICITY_COLUMNS if set(SCHEMA[column].options) == {"Present", "Absent"}]
+
+
+# Patients per toxicity (rows) and worst grade (columns, in severity order)
+def grade_table(counts, index="toxicity"):
+    table = counts.pivot_table(index=index, columns="grade", values="patients", aggfunc="sum", fill_value=0)
+    return table[[grade for grade in TOXICITY_SEVERITY if grade in table.columns]]
+
+
+st.title("Toxicity")
+st.caption("Patients by worst recorded CTCAE grade, from the aggregates kept up to date on every save.")
+
+# The aggregate table is small, so it is read on every rerun instead of cached
+counts = load_toxicity_counts()
+
+regimens = st.multiselect("Regimen", sorted(counts["regimen"].unique()), placeholder="All regimens")
+locations = st.multiselect("Location", LOCATION_OPTIONS + ["Unknown"], placeholder="All locations")
+if regimens:
+    counts = counts[counts["regimen"].isin(regimens)]
+if locations:
+    counts = counts[counts["location"].isin(locations)]
+
+graded = counts[~counts["toxicity"].isin(PRESENCE_TOXICITIES)]
+presence = counts[counts["toxicity"].isin(PRESENCE_TOXICITIES)]
+
+if counts.empty:
+    st.info("No toxicity grades recorded for this selection yet.")
+else:
+    if not graded.empty:
+        table = grade_table(graded)
+        table = table.reindex([column for column in TOXICITY_COLUMNS if column in table.index])
+        severe = table[[grade for grade in ["III", "IV", "V"] if grade in table.columns]].sum(axis=1)
+        table["Patients"] = table.sum(axis=1)
+        table["Grade III+ (%)"] = (100 * severe / table["Patients"]).round(1)
+        st.dataframe(table)
+    if not presence.empty:
+        table = grade_table(presence).reindex(columns=["Absent", "Present"], fill_value=0)
+        table["Patients"] = table.sum(axis=1)
+        table["Present (%)"] = (100 * table["Present"] / table["Patients"]).round(1)
+        st.dataframe(table)
+
+    toxicity = st.selectbox("By regimen and location", sorted(counts["toxicity"].unique(), key=TOXICITY_COLUMNS.index))
+    st.dataframe(grade_table(counts[counts["toxicity"] == toxicity], ["regimen", "location"]))
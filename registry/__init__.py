@@ -0,0 +1,3 @@
+# Core of the sarcoma registry: schema, storage and the analyses built on them.
+# Nothing here imports Streamlit; heavy libraries (pandas, pyarrow, openpyxl)
+# are only imported by the modules, or functions, that need them.
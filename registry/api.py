@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from . import storage
+from .schema import canonicalize
+from .storage import Registry, get_writer, normalize_mrn
+
+logger = logging.getLogger(__name__)
+
+# Largest page a query or visit listing returns
+max_page_size = 1000
+
+
+# Programmatic access to the registry for other tools (eligibility screening,
+# tumor board lists). One instance wraps one warm Registry and is safe to share
+# between threads: reads come from the cached rows and current states, writes
+# go through the process-wide writer, so concurrent upserts share a commit.
+class RegistryAPI:
+    def __init__(self, registry=None, path=None):
+        self.registry = registry or Registry(path)
+        self._index = None
+        self._index_version = None
+        self._index_lock = threading.Lock()
+
+    # Current state of many patients at once, {mrn: state}, None for unknown MRNs
+    def get_many(self, mrns):
+        return self.registry.current_many(mrns)
+
+    # Every visit of one patient, oldest first
+    def history(self, mrn):
+        return self.registry.lookup(mrn)
+
+    # Search index over the current states, rebuilt when visits are added or
+    # rewritten (the registry's generation or epoch changes)
+    def _search_index(self):
+        from .search import build_index
+
+        with self._index_lock:
+            self.registry.refresh()
+            version = (self.registry.epoch, self.registry.generation)
+            if self._index_version != version:
+                self._index = build_index(self.registry)
+                self._index_version = version
+            return self._index
+
+    # One page of the patients matching the search criteria (see
+    # SearchIndex.search), in MRN order, with the total number of matches
+    def query(self, mrn_prefix=None, filters=None, dates=None, offset=0, limit=100):
+        offset, limit = max(int(offset), 0), min(max(int(limit), 0), max_page_size)
+        index = self._search_index()
+        matches = index.search(mrn_prefix, filters, dates)["MRN"]
+        page = matches.iloc[offset:offset + limit].tolist()
+        states = self.registry.current_many(page)
+        return {
+            "total": len(matches),
+            "offset": offset,
+            "limit": limit,
+            "generation": index.generation,
+            "patients": [states[normalize_mrn(mrn)] for mrn in page],
+        }
+
+    # Visits saved after visit id `since`, oldest first; pass the returned
+    # watermark back as `since` for the next page
+    def visits(self, since=0, limit=max_page_size):
+        page = self.registry.visits_since(int(since), min(max(int(limit), 0), max_page_size))
+        return {
+            "watermark": page[-1][0] if page else int(since),
+            "visits": [{"visit_id": visit_id, **row} for visit_id, row in page],
+        }
+
+    # Save many visits in one transaction. A visit for an unknown MRN creates
+    # the patient; otherwise it updates the fields it carries. Rows are checked
+    # against the schema and, with `strict`, rows with problems are not saved.
+    def upsert_many(self, rows, author=None, strict=False):
+        import pandas as pd
+
+        from .schema import validate
+
+        rows = [canonicalize(row) for row in rows]
+        if any(not isinstance(row.get("MRN"), (str, int)) or not normalize_mrn(row["MRN"]) for row in rows):
+            raise ValueError("Every row needs an MRN")
+        problems = validate(pd.DataFrame(rows)) if rows else pd.DataFrame(columns=["row", "MRN", "column", "value"])
+        skipped = sorted(set(problems["row"])) if strict else []
+        saved = [row for number, row in enumerate(rows) if number not in skipped]
+        visit_ids = get_writer(self.registry.path).submit(saved, author).result() if saved else []
+        self.registry.refresh()
+        return {
+            "visit_ids": visit_ids,
+            "skipped": [int(number) for number in skipped],
+            "problems": json.loads(problems.to_json(orient="records")),
+        }
+
+
+def _int(params, name, default):
+    try:
+        return int(params.get(name, [default])[0])
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+# Search criteria from query parameters: indexed columns may repeat
+# (?Location=Trunk&Location=Extremity), date windows are <column>_from and
+# <column>_to
+def _criteria(params):
+    from .search import DATE_INDEXED_COLUMNS, INDEXED_COLUMNS
+
+    filters = {column: params[column] for column in INDEXED_COLUMNS if column in params}
+    dates = {
+        column: (params.get(f"{column}_from", [None])[0], params.get(f"{column}_to", [None])[0])
+        for column in DATE_INDEXED_COLUMNS
+    }
+    return filters, dates
+
+
+# JSON endpoints:
+#   GET  /health                     registry generation and size
+#   GET  /patients?mrn=1&mrn=2       current states of many patients
+#   POST /patients {"mrns": [...]}   same, for batches too long for a URL
+#   GET  /patients/<mrn>/visits      every visit of one patient
+#   GET  /query?Location=Trunk&Biopsy_date_from=2020-01-01&offset=0&limit=100
+#   GET  /visits?since=0&limit=1000  visits after a watermark
+#   POST /visits {"rows": [...], "author": "...", "strict": false}
+class Handler(BaseHTTPRequestHandler):
+    api = None
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            raise ValueError("The request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ValueError("The request body must be a JSON object")
+        return body
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        params = parse_qs(url.query)
+        try:
+            if method == "GET" and parts == ["health"]:
+                registry = self.api.registry.refresh()
+                return self._send(200, {"generation": registry.generation, "visits": len(registry.visit_ids)})
+            if method == "GET" and parts == ["patients"]:
+                return self._send(200, self.api.get_many(params.get("mrn", [])))
+            if method == "POST" and parts == ["patients"]:
+                return self._send(200, self.api.get_many(self._body().get("mrns", [])))
+            if method == "GET" and len(parts) == 3 and parts[0] == "patients" and parts[2] == "visits":
+                return self._send(200, self.api.history(unquote(parts[1])))
+            if method == "GET" and parts == ["query"]:
+                filters, dates = _criteria(params)
+                return self._send(200, self.api.query(
+                    params.get("mrn_prefix", [None])[0], filters, dates,
+                    _int(params, "offset", 0), _int(params, "limit", 100),
+                ))
+            if method == "GET" and parts == ["visits"]:
+                return self._send(200, self.api.visits(_int(params, "since", 0), _int(params, "limit", max_page_size)))
+            if method == "POST" and parts == ["visits"]:
+                body = self._body()
+                if not isinstance(body.get("rows"), list) or not all(isinstance(row, dict) for row in body["rows"]):
+                    raise ValueError("rows must be a list of objects")
+                return self._send(200, self.api.upsert_many(body["rows"], body.get("author"), bool(body.get("strict"))))
+            self._send(404, {"error": f"No endpoint {method} {url.path}"})
+        except ValueError as error:
+            self._send(400, {"error": str(error)})
+        except Exception as error:
+            logger.exception("Request %s %s failed", method, self.path)
+            self._send(500, {"error": str(error)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+# HTTP server answering every request from one shared, warm RegistryAPI;
+# requests are served on their own threads
+def make_server(host="127.0.0.1", port=8765, api=None):
+    handler = type("Handler", (Handler,), {"api": api or RegistryAPI()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the registry as a local JSON API")
+    parser.add_argument("--host", default="127.0.0.1", help="default: localhost only")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database", default=storage.database_file)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    api = RegistryAPI(path=args.database)
+    registry = api.registry.refresh()
+    server = make_server(args.host, args.port, api)
+    print(f"Serving {len(registry.visit_ids)} visits on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import logging
+import re
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from .schema import LEGACY_ALIASES, REGISTRY_COLUMNS, stored_frame, validate
+from .storage import record_visits, transaction
+
+logger = logging.getLogger(__name__)
+
+chunk_size = 5000
+
+
+def _key(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+# Header spellings accepted for each registry column: the column itself, its
+# legacy form keys, and any variant differing only in case, spaces or punctuation
+COLUMN_KEYS = {_key(column): column for column in REGISTRY_COLUMNS}
+COLUMN_KEYS.update((_key(alias), column) for alias, column in LEGACY_ALIASES.items())
+
+
+# Map input headers to registry columns; returns {header: column} and the
+# headers that match nothing
+def map_columns(headers):
+    mapping, unknown = {}, []
+    for header in headers:
+        column = COLUMN_KEYS.get(_key(header))
+        if column is None or column in mapping.values():
+            unknown.append(header)
+        else:
+            mapping[header] = column
+    return mapping, unknown
+
+
+# Read a CSV or XLSX file (path or uploaded file object) as DataFrames of at
+# most `size` rows, without loading the whole file
+def read_chunks(source, name=None, size=None):
+    size = size or chunk_size
+    name = name or getattr(source, "name", str(source))
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        yield from _read_excel_chunks(source, size)
+    else:
+        yield from pd.read_csv(source, chunksize=size, dtype=str, keep_default_na=False, na_values=[""])
+
+
+def _read_excel_chunks(source, size):
+    from openpyxl import load_workbook
+
+    with closing(load_workbook(source, read_only=True, data_only=True)) as workbook:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(header) if header is not None else "" for header in next(rows, [])]
+        chunk = []
+        for row in rows:
+            if any(value is not None for value in row):
+                chunk.append(row)
+            if len(chunk) == size:
+                yield pd.DataFrame(chunk, columns=headers)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=headers)
+
+
+def _rows(df):
+    return [
+        {column: value for column, value in row.items() if not (isinstance(value, float) and pd.isna(value))}
+        for row in df.to_dict("records")
+    ]
+
+
+# Stream a legacy spreadsheet or EHR extract into the registry. Columns are
+# mapped onto the registry schema and every chunk is validated; with `strict`
+# rows that fail validation are skipped. Values are stored with the types the
+# form saves (see stored_frame). All chunks are written in a single
+# transaction, so a failed import leaves the registry untouched. `author` is
+# recorded with every imported visit.
+def import_file(source, name=None, strict=False, size=None, author=None):
+    started = time.perf_counter()
+    report = {"rows": 0, "imported": 0, "skipped": 0, "unknown_columns": [], "problems": []}
+    with transaction() as conn:
+        for chunk in read_chunks(source, name, size):
+            mapping, unknown = map_columns(chunk.columns)
+            if "MRN" not in mapping.values():
+                raise ValueError("The file has no MRN column")
+            report["unknown_columns"] = sorted(set(report["unknown_columns"]) | set(unknown))
+            # Number rows across the file; CSV chunks already continue the index, Excel ones start at 0
+            chunk = chunk[list(mapping)].rename(columns=mapping).reset_index(drop=True)
+            chunk.index += report["rows"]
+            report["rows"] += len(chunk)
+
+            chunk = chunk[chunk["MRN"].notna() & (chunk["MRN"].astype(str).str.strip() != "")]
+            problems = validate(chunk)
+            report["problems"].append(problems)
+            if strict:
+                chunk = chunk.drop(index=problems["row"].unique())
+            record_visits(conn, _rows(stored_frame(chunk)), author)
+            report["imported"] += len(chunk)
+
+    report["skipped"] = report["rows"] - report["imported"]
+    report["problems"] = pd.concat(report["problems"], ignore_index=True) if report["problems"] else validate(
+        pd.DataFrame(columns=["MRN"])
+    )
+    report["seconds"] = time.perf_counter() - started
+    report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
+    if report["unknown_columns"]:
+        logger.warning("Ignored columns not in the registry: %s", ", ".join(report["unknown_columns"]))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import a CSV or XLSX file into the registry")
+    parser.add_argument("path")
+    parser.add_argument("--strict", action="store_true", help="skip rows that fail schema validation")
+    parser.add_argument("--chunk-size", type=int, default=chunk_size)
+    parser.add_argument("--problems", help="write validation problems to this CSV file")
+    parser.add_argument("--author", help="recorded with every imported visit (default: the file name)")
+    args = parser.parse_args(argv)
+
+    report = import_file(args.path, strict=args.strict, size=args.chunk_size, author=args.author or args.path)
+    if args.problems:
+        report["problems"].to_csv(args.problems, index=False)
+    print(
+        f"{report['imported']} of {report['rows']} rows imported ({report['skipped']} skipped, "
+        f"{len(report['problems'])} validation problems) in {report['seconds']:.2f}s "
+        f"({report['rows_per_second']:.0f} rows/s)"
+    )
+    if report["unknown_columns"]:
+        print("Ignored columns:", ", ".join(report["unknown_columns"]))
+
+
+if __name__ == "__main__":
+    main()
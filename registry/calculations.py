@@ -0,0 +1,122 @@
+import argparse
+import time
+from datetime import date
+
+from .schema import encode_frame
+from .storage import load_visits, rewrite_visits
+
+# Derived interval columns: (start date, end date, event flag or None)
+INTERVALS = {
+    "Follow_up_time": ("Date_of_Last_Radiotherapy", "Follow_up_date", None),
+    "Time_to_Local_Recurrence": ("Date_of_Last_Radiotherapy", "Local_Recurrence_date", "Local_Recurrence"),
+    "Time_to_Regional_Recurrence": ("Date_of_Last_Radiotherapy", "Regional_Recurrence_date", "Regional_Recurrence"),
+    "Time_to_Distant_Recurrence": ("Date_of_Last_Radiotherapy", "Distant_Recurrence_date", "Distant_Recurrence"),
+    "Time_to_Death": ("Date_of_Last_Radiotherapy", "Death_date", "Death"),
+}
+
+
+# Helper function to calculate time in months
+def calculate_months(start_date, end_date):
+    return (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month)
+
+
+# Age in completed years on a given day
+def calculate_age(date_of_birth, on):
+    return on.year - date_of_birth.year - ((on.month, on.day) < (date_of_birth.month, date_of_birth.day))
+
+
+# Age stored with a visit: taken at the follow-up date (the day the visit was
+# seen), or `today` when there is none. recompute_derived uses the same rule
+# but leaves Age alone on visits without a follow-up date.
+def visit_age(date_of_birth, follow_up_date=None, today=None):
+    return calculate_age(date_of_birth, follow_up_date or today or date.today())
+
+
+# calculate_months over whole datetime64 columns
+def months_between(start, end):
+    return (end.dt.year - start.dt.year) * 12 + (end.dt.month - start.dt.month)
+
+
+# Age in completed years on the dates in `on`, vectorized calculate_age
+def age_on(birth, on):
+    before_birthday = (birth.dt.month > on.dt.month) | ((birth.dt.month == on.dt.month) & (birth.dt.day > on.dt.day))
+    return on.dt.year - birth.dt.year - before_birthday.astype(int)
+
+
+# Integer Series as objects, with None where the value is missing
+def _values(series):
+    series = series.astype("Int64").astype(object)
+    return series.where(series.notna(), None)
+
+
+# Recompute Age and the interval columns for every row of a registry frame in
+# one vectorized pass. Age is taken as in visit_age, at the follow-up date of
+# the visit. A value is only recomputed where its dates are present; elsewhere
+# it is None, meaning "keep what is stored": visits saved before event dates
+# were recorded still carry the interval the form computed then. Intervals whose
+# event is recorded as anything but "Yes" are "N/A".
+def recompute_derived(df):
+    import pandas as pd
+
+    needed = {"Date_of_Birth"} | {column for interval in INTERVALS.values() for column in interval if column}
+    encoded = encode_frame(df[[column for column in df.columns if column in needed]])
+    derived = pd.DataFrame(index=df.index)
+    if "Date_of_Birth" in encoded and "Follow_up_date" in encoded:
+        derived["Age"] = _values(age_on(encoded["Date_of_Birth"], encoded["Follow_up_date"]))
+    for column, (start, end, event) in INTERVALS.items():
+        if start not in encoded or end not in encoded:
+            continue
+        months = _values(months_between(encoded[start], encoded[end]))
+        if event is not None:
+            flag = encoded[event] if event in encoded else pd.Series(None, index=df.index, dtype=object)
+            months = months.where(flag == "Yes", None)
+            months[flag.notna() & (flag != "Yes")] = "N/A"
+        derived[column] = months
+    return derived
+
+
+# Stored form of a derived value: an int, or "N/A" like the form writes
+def _stored(value):
+    if isinstance(value, str):
+        return value or "N/A"
+    if value is None or (isinstance(value, float) and value != value):
+        return "N/A"
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Changes needed to bring stored visits in line with recompute_derived, as
+# {visit_id: {column: value}}; values it could not recompute are left alone
+def derived_updates(visits):
+    derived = recompute_derived(visits)
+    updates = {}
+    for column in derived.columns:
+        known = derived[column].notna()
+        stored = visits.loc[known, column].map(_stored)
+        new = derived.loc[known, column].map(_stored)
+        changed = stored.astype(str) != new.astype(str)
+        for visit_id, value in new[changed].items():
+            updates.setdefault(visit_id, {})[column] = value
+    return updates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute derived age and interval columns for the whole registry")
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing them")
+    parser.add_argument("--author", default="registry.calculations", help="recorded with every correction")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    visits = load_visits()
+    updates = derived_updates(visits)
+    if not args.dry_run:
+        rewrite_visits(updates, args.author)
+    print(
+        f"{len(updates)} of {len(visits)} visits {'would change' if args.dry_run else 'updated'} "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
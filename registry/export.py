@@ -0,0 +1,232 @@
+import argparse
+import csv
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .schema import LIST_COLUMNS, REGISTRY_COLUMNS, SCHEMA, encode_bits, encode_frame
+from .storage import iter_visits
+
+# Streaming export of the registry for analysis. Visits are read from the
+# database and written out one chunk at a time, so memory stays flat however
+# large the registry is. Formats:
+# - csv: the stored values, one row per visit
+# - redcap: REDCap's import layout, with choices coded 1..n and multiselects
+#   expanded to checkbox columns (see `redcap_dictionary` for the matching
+#   data dictionary)
+# - parquet: typed columns, multiselects as lists of strings
+FORMATS = ["csv", "redcap", "parquet"]
+chunk_size = 5000
+
+
+def _format_for(path):
+    return "parquet" if str(path).endswith(".parquet") else "csv"
+
+
+# Rows of a chunk that pass the filters: a date window on `date_column`,
+# Locations, and Histologies (a visit matches if it has any of them)
+def _select(df, date_column="Follow_up_date", start=None, end=None, locations=None, histologies=None):
+    mask = pd.Series(True, index=df.index)
+    if start or end:
+        dates = encode_frame(df[[date_column]])[date_column]
+        if start:
+            mask &= dates >= pd.Timestamp(start)
+        if end:
+            mask &= dates <= pd.Timestamp(end)
+    if locations:
+        mask &= df["Location"].isin(locations)
+    if histologies:
+        mask &= (encode_frame(df[["Histology"]])["Histology"] & encode_bits(histologies, "Histology")) != 0
+    return df[mask]
+
+
+# Multiselect lists are written in their string form, as in the Excel export
+def _csv_chunk(df):
+    df = df.copy()
+    for column in df.columns.intersection(LIST_COLUMNS):
+        df[column] = df[column].map(lambda value: str(value) if isinstance(value, list) else value)
+    return df
+
+
+# REDCap field names are lower case
+def _redcap_name(column):
+    return column.lower()
+
+
+def _redcap_chunk(df, repeating):
+    encoded = encode_frame(df.drop(columns=["visit_id", "visit_number"], errors="ignore"))
+    columns = {"record_id": df["MRN"]}
+    if repeating:
+        columns["redcap_repeat_instrument"] = "visit"
+        columns["redcap_repeat_instance"] = df["visit_number"]
+    for column in encoded.columns.drop("MRN"):
+        field = SCHEMA.get(column)
+        values = encoded[column]
+        name = _redcap_name(column)
+        if field is None or field.kind == "text":
+            columns[name] = values
+        elif field.kind == "date":
+            columns[name] = values.dt.strftime("%Y-%m-%d")
+        elif field.kind == "number":
+            columns[name] = values.astype("Int64") if (values.dropna() % 1 == 0).all() else values
+        elif field.kind == "enum":
+            codes = pd.Series(values.cat.codes, index=values.index)
+            columns[name] = (codes + 1).astype("Int64").where(codes >= 0)
+        else:
+            bits = values.to_numpy()
+            for position in range(len(field.options)):
+                columns[f"{name}___{position + 1}"] = (bits >> position) & 1
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _arrow_type(column):
+    kind = SCHEMA[column].kind if column in SCHEMA else "text"
+    return {
+        "date": pa.timestamp("ns"),
+        "number": pa.float64(),
+        "multi": pa.list_(pa.string()),
+    }.get(kind, pa.string())
+
+
+def _arrow_schema(columns):
+    fields = [pa.field("visit_id", pa.int64())]
+    return pa.schema(fields + [pa.field(column, _arrow_type(column)) for column in columns])
+
+
+def _arrow_chunk(df, schema):
+    encoded = encode_frame(df.drop(columns=["visit_id"]), lists=True)
+    for column in encoded.columns:
+        if isinstance(encoded[column].dtype, pd.CategoricalDtype):
+            encoded[column] = encoded[column].astype(object).where(encoded[column].notna(), None)
+    encoded.insert(0, "visit_id", df["visit_id"])
+    return pa.Table.from_pandas(encoded, schema=schema, preserve_index=False)
+
+
+# Stream the registry to `out` (a path or a binary file object). `columns`
+# projects the export (MRN is always included), `since` exports only visits
+# added after that watermark, `current` exports each patient's current state
+# instead of every visit, and the remaining keywords are row filters (see
+# `_select`). Returns the number of rows written and the new watermark: the
+# highest visit id read, to pass as `since` next time.
+def export(out, format=None, columns=None, since=0, current=False, size=None, **filters):
+    format = format or _format_for(out)
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format!r}; expected one of {', '.join(FORMATS)}")
+    columns = ["MRN"] + [column for column in (columns or REGISTRY_COLUMNS) if column != "MRN"]
+    needed = columns + ["Location", "Histology"]
+    if filters.get("start") or filters.get("end"):
+        needed.append(filters.get("date_column", "Follow_up_date"))
+    repeating = format == "redcap" and not current
+    report = {"rows": 0, "watermark": since}
+
+    path = out if isinstance(out, (str, os.PathLike)) else None
+    target = f"{path}.tmp" if path else out
+    handle = open(target, "wb") if path else out
+    schema = _arrow_schema(columns)
+    writer = pq.ParquetWriter(handle, schema) if format == "parquet" else None
+    text = io.TextIOWrapper(handle, encoding="utf-8", newline="") if writer is None else None
+    header = True
+    try:
+        for chunk in iter_visits(since, size or chunk_size, current=current, numbered=repeating):
+            report["watermark"] = chunk[-1][0]
+            df = pd.DataFrame([entry[-1] for entry in chunk]).reindex(columns=list(dict.fromkeys(needed)))
+            df["visit_id"] = [entry[0] for entry in chunk]
+            if repeating:
+                df["visit_number"] = [entry[1] for entry in chunk]
+            df = _select(df, **filters)
+            df = df[["visit_id"] + columns + (["visit_number"] if repeating else [])]
+            if writer is not None:
+                writer.write_table(_arrow_chunk(df, schema))
+            elif len(df):
+                _write_csv(text, df, format, repeating, header)
+                header = False
+            report["rows"] += len(df)
+        if writer is not None:
+            writer.close()
+        else:
+            if header:
+                empty = pd.DataFrame(columns=["visit_id"] + columns + (["visit_number"] if repeating else []))
+                _write_csv(text, empty, format, repeating, header)
+            text.detach()
+    finally:
+        if path:
+            handle.close()
+    if path:
+        os.replace(target, path)
+    return report
+
+
+def _write_csv(text, df, format, repeating, header):
+    if format == "redcap":
+        df = _redcap_chunk(df, repeating)
+    else:
+        df = _csv_chunk(df)
+    df.to_csv(text, header=header, index=False)
+    text.flush()
+
+
+# REDCap data dictionary for a "redcap" export of `columns`, to a path or text file object
+def redcap_dictionary(out, columns=None):
+    header = [
+        "Variable / Field Name", "Form Name", "Section Header", "Field Type", "Field Label",
+        "Choices, Calculations, OR Slider Labels", "Field Note", "Text Validation Type OR Show Slider Number",
+    ]
+    rows = [["record_id", "visit", "", "text", "MRN", "", "", ""]]
+    for column in columns or REGISTRY_COLUMNS:
+        if column == "MRN":
+            continue
+        field = SCHEMA[column]
+        choices = " | ".join(f"{position + 1}, {option}" for position, option in enumerate(field.options or []))
+        field_type, validation = {
+            "date": ("text", "date_ymd"),
+            "number": ("text", "number"),
+            "enum": ("radio", ""),
+            "multi": ("checkbox", ""),
+        }.get(field.kind, ("text", ""))
+        rows.append([_redcap_name(column), "visit", "", field_type, column.replace("_", " "), choices, "", validation])
+    if not isinstance(out, (str, os.PathLike)):
+        csv.writer(out).writerows([header] + rows)
+        return
+    with open(out, "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows([header] + rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the registry to CSV, a REDCap import file or Parquet")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--columns", nargs="+", help="columns to export (default: all)")
+    parser.add_argument("--current", action="store_true", help="one row per patient with the current state")
+    parser.add_argument("--since", type=int, default=0, help="only visits after this visit id")
+    parser.add_argument("--watermark-file", help="read --since from this file and store the new watermark in it")
+    parser.add_argument("--date-column", default="Follow_up_date")
+    parser.add_argument("--start", help="earliest date (YYYY-MM-DD) in --date-column")
+    parser.add_argument("--end", help="latest date (YYYY-MM-DD) in --date-column")
+    parser.add_argument("--location", nargs="+", dest="locations")
+    parser.add_argument("--histology", nargs="+", dest="histologies")
+    parser.add_argument("--dictionary", help="also write the REDCap data dictionary to this file")
+    parser.add_argument("--chunk-size", type=int, default=chunk_size)
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if args.watermark_file and os.path.exists(args.watermark_file):
+        with open(args.watermark_file) as file:
+            since = int(file.read().strip() or 0)
+    report = export(
+        args.path, args.format, args.columns, since, args.current, args.chunk_size,
+        date_column=args.date_column, start=args.start, end=args.end,
+        locations=args.locations, histologies=args.histologies,
+    )
+    if args.dictionary:
+        redcap_dictionary(args.dictionary, args.columns)
+    if args.watermark_file:
+        with open(args.watermark_file, "w") as file:
+            file.write(str(report["watermark"]))
+    print(f"{report['rows']} rows written to {args.path} (watermark {report['watermark']})")
+
+
+if __name__ == "__main__":
+    main()
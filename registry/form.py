@@ -0,0 +1,108 @@
+from datetime import date, datetime
+
+from .schema import SCHEMA, parse_list
+
+# Registry columns entered through the form. Each widget is keyed by its
+# column, so the values live in st.session_state and sections can rerun
+# on their own without losing the rest of the form.
+FORM_FIELDS = [
+    column for column in SCHEMA
+    if column not in ("MRN", "Age", "Follow_up_time", "Surgery_type") and not column.startswith("Time_to_")
+]
+# Fields only shown (and saved) when another answer enables them
+CONDITIONAL_FIELDS = {
+    "Recurrence_date": ("Recurrent_Tumor", "Yes"),
+    "Surgery_date": ("Recurrent_Tumor", "Yes"),
+    "Ureteral_Stenosis_Date": ("Ureteral_Stenosis", "Present"),
+    "Local_Recurrence_date": ("Local_Recurrence", "Yes"),
+    "Regional_Recurrence_date": ("Regional_Recurrence", "Yes"),
+    "Distant_Recurrence_date": ("Distant_Recurrence", "Yes"),
+    "Death_date": ("Death", "Yes"),
+    "Cancer_Related_Death": ("Death", "Yes"),
+}
+
+# T classification help shown next to the staging fields, as one markdown
+# block each so a rerun renders one element instead of a line per stage
+STAGE_EXTREMITY_HELP = "  \n".join([
+    "cT0: No evidence of primary tumor",
+    "cTx: Primary tumor cannot be assessed",
+    "cT1: Tumor ≤5 cm in greatest dimension",
+    "cT2: Tumor >5 cm but ≤10 cm in greatest dimension",
+    "cT3: Tumor >10 cm in greatest dimension",
+    "cT4: Tumor of any size with direct extension into the ipsilateral adrenal gland",
+])
+STAGE_RETROPERITONEUM_HELP = "  \n".join([
+    "cT0: No evidence of primary tumor",
+    "cTx: Primary tumor cannot be assessed",
+    "cT1: Organ confined tumor",
+    "cT2a: Tumor invades serosa or visceral peritoneum",
+    "cT2b: TTumor extends beyond serosa (mesentery)",
+    "cT3: Tumor invades another organ",
+    "cT4a: Multifocal tumor involvement (2 sites)",
+    "cT4b: Multifocal tumor involvement (3-5 sites)",
+    "cT4c: Multifocal tumor involvement (> 5 sites)",
+])
+
+
+# Function to safely retrieve data, handling NaN values
+def safe_get(data, key, default=""):
+    value = data.get(key, default)
+    if value is None or (isinstance(value, float) and value != value):
+        return default
+    return value
+
+
+# Function to safely retrieve a list from stored string values
+def safe_get_list(data, key):
+    return parse_list(data.get(key, ""))
+
+
+# Widget value for a stored field, or None when the stored value cannot be shown
+def widget_value(data, column):
+    field = SCHEMA[column]
+    value = safe_get(data, column, None)
+    if value is None:
+        return None
+    if field.kind == "date":
+        try:
+            return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return None
+    if field.kind == "multi":
+        return [item for item in safe_get_list(data, column) if item in field.options]
+    if field.kind == "enum":
+        return value if value in field.options else None
+    if field.kind == "number":
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+    return value
+
+
+# Stored form of a widget value
+def stored_value(value):
+    if value is None:
+        return "N/A"
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+# Visit to save from the form values: fields hidden by their condition are
+# saved as "N/A", and the derived results are stored under their columns
+def visit_data(mrn, values, results):
+    data = {"MRN": mrn}
+    for column in FORM_FIELDS:
+        condition = CONDITIONAL_FIELDS.get(column)
+        enabled = condition is None or values.get(condition[0]) == condition[1]
+        data[column] = stored_value(values.get(column)) if enabled else "N/A"
+    data.update({
+        "Age": results["age"],
+        "Follow_up_time": results["time_since_treatment"],
+        "Time_to_Local_Recurrence": results["time_to_local_recurrence"],
+        "Time_to_Regional_Recurrence": results["time_to_regional_recurrence"],
+        "Time_to_Distant_Recurrence": results["time_to_distant_recurrence"],
+        "Time_to_Death": results["time_to_death"],
+    })
+    return data
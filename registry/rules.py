@@ -0,0 +1,121 @@
+import argparse
+from collections import namedtuple
+
+import pandas as pd
+
+from .schema import PRESENCE, REGISTRY_COLUMNS, TOXICITY_COLUMNS, encode_frame
+from .storage import load_visits
+
+# Data-quality rules. Each check takes a schema-encoded registry frame (see
+# schema.encode_frame) and the stored frame it came from, and returns a boolean
+# mask of the rows breaking the rule, so every rule is one vectorized pass.
+# Rows missing a date a rule needs do not break it.
+Rule = namedtuple("Rule", ["name", "message", "check"])
+
+
+def _before(encoded, earlier, later):
+    return encoded[later] < encoded[earlier]
+
+
+def _flag_without_date(encoded, flag, date):
+    return encoded[date].notna() & (encoded[flag] != "Yes")
+
+
+def _outside_options(df, column, options):
+    values = df[column]
+    return values.notna() & ~values.isin(options + ["", "N/A"])
+
+
+def _grade_v(encoded):
+    grade_v = pd.Series(False, index=encoded.index)
+    for column in TOXICITY_COLUMNS:
+        grade_v |= encoded[column] == "V"
+    return grade_v
+
+
+RULES = [
+    Rule("follow_up_before_rt", "Follow-up date is before the last radiotherapy",
+        lambda encoded, df: _before(encoded, "Date_of_Last_Radiotherapy", "Follow_up_date")),
+    Rule("surgery_before_biopsy", "Surgery date is before the biopsy",
+        lambda encoded, df: _before(encoded, "Biopsy_date", "Surgery_date")),
+    Rule("rt_before_biopsy", "Last radiotherapy is before the biopsy",
+        lambda encoded, df: _before(encoded, "Biopsy_date", "Date_of_Last_Radiotherapy")),
+    Rule("rt_before_birth", "Last radiotherapy is before the date of birth",
+        lambda encoded, df: _before(encoded, "Date_of_Birth", "Date_of_Last_Radiotherapy")),
+    Rule("systemic_treatment_dates", "Last systemic treatment date is before the first",
+        lambda encoded, df: _before(encoded, "Systemic_Treatment_first_date", "Systemic_Treatment_last_date")),
+    Rule("recurrence_date_without_recurrence", "Recurrence date given but Recurrent Tumor is not Yes",
+        lambda encoded, df: _flag_without_date(encoded, "Recurrent_Tumor", "Recurrence_date")),
+    Rule("local_recurrence_date_without_event", "Local recurrence date given but Local Recurrence is not Yes",
+        lambda encoded, df: _flag_without_date(encoded, "Local_Recurrence", "Local_Recurrence_date")),
+    Rule("regional_recurrence_date_without_event", "Regional recurrence date given but Regional Recurrence is not Yes",
+        lambda encoded, df: _flag_without_date(encoded, "Regional_Recurrence", "Regional_Recurrence_date")),
+    Rule("distant_recurrence_date_without_event", "Distant recurrence date given but Distant Recurrence is not Yes",
+        lambda encoded, df: _flag_without_date(encoded, "Distant_Recurrence", "Distant_Recurrence_date")),
+    Rule("death_date_without_death", "Death date given but Death is not Yes",
+        lambda encoded, df: _flag_without_date(encoded, "Death", "Death_date")),
+    Rule("cancer_death_without_death", "Cancer related death but Death is not Yes",
+        lambda encoded, df: (encoded["Cancer_Related_Death"] == "Yes") & (encoded["Death"] != "Yes")),
+    Rule("follow_up_after_death", "Follow-up date is after the date of death",
+        lambda encoded, df: _before(encoded, "Follow_up_date", "Death_date")),
+    Rule("grade_v_without_death", "A CTCAE grade V (death) toxicity is recorded but Death is not Yes",
+        lambda encoded, df: _grade_v(encoded) & (encoded["Death"] != "Yes")),
+    Rule("ureteral_stenosis_date_without_stenosis", "Ureteral stenosis date given but stenosis is not Present",
+        lambda encoded, df: encoded["Ureteral_Stenosis_Date"].notna() & (encoded["Ureteral_Stenosis"] != "Present")),
+    # Plain vocabulary check, the same as schema.validate's, run over stored rows
+    Rule("necrosis_lvi_not_presence", "Necrosis or LVI holds a value that is not Present/Absent/Not Reported",
+        lambda encoded, df: _outside_options(df, "Necrosis", PRESENCE) | _outside_options(df, "LVI", PRESENCE)),
+]
+RULE_NAMES = [rule.name for rule in RULES]
+
+
+# Run every rule over a registry frame in one pass. `encoded` can be passed
+# when the caller already has the encoded frame. Returns one row per broken
+# rule and row: the row's index label, MRN, rule name and message.
+def check(df, encoded=None):
+    df = df.reindex(columns=list(dict.fromkeys(REGISTRY_COLUMNS + list(df.columns))))
+    encoded = encode_frame(df) if encoded is None else encoded.reindex(index=df.index, columns=df.columns)
+    violations = []
+    for rule in RULES:
+        broken = rule.check(encoded, df).fillna(False).to_numpy(dtype=bool)
+        if broken.any():
+            violations.append(pd.DataFrame({
+                "row": df.index[broken],
+                "MRN": df["MRN"].to_numpy()[broken],
+                "rule": rule.name,
+                "message": rule.message,
+            }))
+    if not violations:
+        return pd.DataFrame(columns=["row", "MRN", "rule", "message"])
+    return pd.concat(violations, ignore_index=True)
+
+
+# Rules broken by one row, e.g. a patient's state after a save
+def check_row(row):
+    return check(pd.DataFrame([row]))
+
+
+# Violations of a Registry's visits, labelled by visit id
+def check_registry(registry):
+    violations = check(registry.frame(), registry.frame(encoded=True))
+    visit_ids = registry.visit_ids
+    return violations.assign(row=[visit_ids[row] for row in violations["row"]]).rename(columns={"row": "visit_id"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check every visit of the registry against the data-quality rules")
+    parser.add_argument("--output", help="write the violations to this CSV file")
+    args = parser.parse_args(argv)
+
+    visits = load_visits()
+    violations = check(visits).rename(columns={"row": "visit_id"})
+    if args.output:
+        violations.to_csv(args.output, index=False)
+    counts = violations.groupby("rule").agg(visits=("visit_id", "size"), patients=("MRN", "nunique"))
+    print(f"{len(violations)} violations in {len(visits)} visits")
+    if len(counts):
+        print(counts.to_string())
+
+
+if __name__ == "__main__":
+    main()
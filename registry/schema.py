@@ -0,0 +1,315 @@
+from collections import namedtuple
+
+# Declared schema of the registry. Every column has a kind:
+#   text    free text, kept as a string
+#   date    "%Y-%m-%d" string in storage, datetime64 when encoded
+#   number  int/float
+#   enum    one of `options`, encoded as a small-integer categorical
+#   multi   any subset of `options`, encoded as an int64 bitset (bit i = options[i])
+Field = namedtuple("Field", ["kind", "options"], defaults=[None])
+
+# Values the form stores for "not applicable"
+MISSING_VALUES = ["", "N/A"]
+
+YES_NO = ["No", "Yes"]
+PRESENCE = ["Present", "Absent", "Not Reported"]
+GRADE_OPTIONS = ["I", "II", "III", "Not Reported"]
+LOCATION_OPTIONS = ["Extremity", "Trunk", "Head and Neck", "Retroperitoneum", "Prostate", "Non-Extremity Bone", "Other"]
+TOLERANCE_OPTIONS = ["Excellent", "Good", "Fair", "Poor"]
+HISTOLOGY_OPTIONS = [
+    "Atypical lipomatous tumour",
+    "Liposarcoma",
+    "Myxoid liposarcoma",
+    "Pleomorphic liposarcoma",
+    "Dermatofibrosarcoma protuberans NOS",
+    "Dermatofibrosarcoma protuberans, fibrosarcomatous",
+    "Solitary fibrous tumour NOS",
+    "Inflammatory myofibroblastic tumour",
+    "Epithelioid inflammatory myofibroblastic sarcoma",
+    "Myxoinflammatory fibroblastic sarcoma",
+    "Infantile fibrosarcoma",
+    "Fibrosarcoma NOS",
+    "Myxofibrosarcoma",
+    "Epithelioid myxofibrosarcoma",
+    "Low grade fibromyxoid sarcoma",
+    "Sclerosing epithelioid fibrosarcoma",
+    "Plexiform fibrohistiocytic tumour",
+    "Giant cell tumour of soft parts",
+    "Haemangioendothelioma",
+    "Kaposi sarcoma",
+    "Epithelioid haemangioendothelioma NOS",
+    "Epithelioid haemangioendothelioma with WWTR1-CAMTA1 fusion",
+    "Epithelioid haemangioendothelioma with YAP1-TFE3 fusion",
+    "Angiosarcoma",
+    "Glomus tumour, malignant",
+    "Leiomyosarcoma NOS",
+    "Embryonal rhabdomyosarcoma NOS",
+    "Embryonal rhabdomyosarcoma, pleomorphic",
+    "Alveolar rhabdomyosarcoma",
+    "Pleomorphic rhabdomyosarcoma NOS",
+    "Spindle cell rhabdomyosarcoma",
+    "Osteosarcoma, extraskeletal",
+    "Malignant peripheral nerve sheath tumour NOS",
+    "Malignant peripheral nerve sheath tumour, epithelioid",
+    "Malignant melanotic nerve sheath tumour",
+    "Atypical fibroxanthoma",
+    "Angiomatoid fibrous histiocytoma",
+    "Ossifying fibromyxoid tumour NOS",
+    "Synovial sarcoma, specify type",
+    "Epithelioid sarcoma",
+    "Proximal or large cell epithelioid sarcoma",
+    "Classic epithelioid sarcoma",
+    "Alveolar soft part sarcoma",
+    "Clear cell sarcoma of soft tissue",
+    "Extraskeletal myxoid chondrosarcoma",
+    "Desmoplastic small round cell tumour",
+    "Rhabdoid tumour of soft tissue",
+    "Perivascular epithelioid tumour, malignant",
+    "Myoepithelial carcinoma",
+    "Mixed tumour, malignant, NOS",
+    "Undifferentiated sarcoma",
+    "Spindle cell sarcoma, undifferentiated",
+    "Pleomorphic sarcoma, undifferentiated",
+    "Round cell sarcoma, undifferentiated",
+    "Ewing sarcoma",
+    "Other",
+]
+STAGE_EXTREMITY_OPTIONS = ["cT0", "cTx", "cT1", "cT2", "cT3", "cT4", "cN0", "cN1", "M0", "M1", "Non Extremity"]
+STAGE_RETROPERITONEUM_OPTIONS = [
+    "cT0", "cTx", "cT1", "cT2a", "cT2b", "cT3", "cT4a", "cT4b", "cT4c", "cN0", "cN1", "M0", "M1", "Non Retroperitoneal"
+]
+SYSTEMIC_TREATMENT_OPTIONS = [
+    "None", "Conventional Chemotherapy", "Target Therapy", "Immunotherapy", "Radioligant", "ADC", "Others"
+]
+
+# CTCAE v5 grade scales used by the toxicity questions
+CTCAE_NONE_TO_V = ["None", "I", "II", "III", "IV", "V"]
+CTCAE_NONE_TO_III = ["None", "I", "II", "III"]
+CTCAE_ABSENT_TO_V = ["Absent", "I", "II", "III", "IV", "V"]
+CTCAE_ABSENT_II_TO_V = ["Absent", "II", "III", "IV", "V"]
+CTCAE_ABSENT_TO_III = ["Absent", "I", "II", "III"]
+CTCAE_ABSENT_III_TO_V = ["Absent", "III", "IV", "V"]
+PRESENT_ABSENT = ["Present", "Absent"]
+ABSENT_PRESENT = ["Absent", "Present"]
+
+# Toxicity answers from least to most severe, across all the scales above. The
+# option lists are in display order, which is not always severity order.
+TOXICITY_SEVERITY = ["None", "Absent", "Present", "I", "II", "III", "IV", "V"]
+
+SCHEMA = {
+    "MRN": Field("text"),
+    "Date_of_Birth": Field("date"),
+    "Age": Field("number"),
+    "Date_of_Last_Radiotherapy": Field("date"),
+    "Follow_up_date": Field("date"),
+    "Follow_up_time": Field("number"),
+    "Histology": Field("multi", HISTOLOGY_OPTIONS),
+    "Grade": Field("enum", GRADE_OPTIONS),
+    "Necrosis": Field("enum", PRESENCE),
+    "LVI": Field("enum", PRESENCE),
+    "Mytotic_Count": Field("number"),
+    "Location": Field("enum", LOCATION_OPTIONS),
+    "Clinical_Stage_Extremity": Field("multi", STAGE_EXTREMITY_OPTIONS),
+    "Clinical_Stage_Retroperitoneum": Field("multi", STAGE_RETROPERITONEUM_OPTIONS),
+    "Biopsy_date": Field("date"),
+    "Recurrent_Tumor": Field("enum", YES_NO),
+    "Recurrence_date": Field("date"),
+    "Surgery_type": Field("text"),
+    "Surgery_date": Field("date"),
+    "Systemic_Treatment": Field("multi", SYSTEMIC_TREATMENT_OPTIONS),
+    "Systemic_Treatment_first_date": Field("date"),
+    "Systemic_Treatment_last_date": Field("date"),
+    "Dose_per_Fraction": Field("number"),
+    "Fractionation": Field("number"),
+    "Fatigue": Field("enum", CTCAE_NONE_TO_III),
+    "Dysuria": Field("enum", PRESENT_ABSENT),
+    "Cystitis": Field("enum", CTCAE_NONE_TO_V),
+    "Bladder_Perforation": Field("enum", CTCAE_ABSENT_II_TO_V),
+    "Hematuria": Field("enum", CTCAE_ABSENT_TO_V),
+    "Urinary_Fistula": Field("enum", CTCAE_ABSENT_II_TO_V),
+    "Urinary_Obstruction": Field("enum", CTCAE_ABSENT_TO_V),
+    "Ureteral_Stenosis": Field("enum", ABSENT_PRESENT),
+    "Ureteral_Stenosis_Date": Field("date"),
+    "Urinary_Retention": Field("enum", CTCAE_ABSENT_TO_V),
+    "Diarrhea": Field("enum", CTCAE_ABSENT_TO_V),
+    "Nausea": Field("enum", CTCAE_ABSENT_TO_V),
+    "Bowel_Perforation": Field("enum", CTCAE_ABSENT_II_TO_V),
+    "Bowel_Obstruction": Field("enum", CTCAE_ABSENT_TO_V),
+    "Proctitis": Field("enum", CTCAE_ABSENT_TO_V),
+    "Rectal_Fistula": Field("enum", CTCAE_ABSENT_TO_V),
+    "Rectal_Hemorrhage": Field("enum", CTCAE_ABSENT_TO_V),
+    "Rectal_Pain": Field("enum", CTCAE_ABSENT_TO_III),
+    "Rectal_Perforation": Field("enum", CTCAE_ABSENT_II_TO_V),
+    "Rectal_Stenosis": Field("enum", CTCAE_ABSENT_TO_V),
+    "Organ_Failure": Field("enum", CTCAE_ABSENT_III_TO_V),
+    "Pneumonitis": Field("enum", CTCAE_NONE_TO_V),
+    "Esophagitis": Field("enum", CTCAE_NONE_TO_V),
+    "Overal_tolerance": Field("enum", TOLERANCE_OPTIONS),
+    "Local_Recurrence": Field("enum", YES_NO),
+    "Local_Recurrence_date": Field("date"),
+    "Regional_Recurrence": Field("enum", YES_NO),
+    "Regional_Recurrence_date": Field("date"),
+    "Distant_Recurrence": Field("enum", YES_NO),
+    "Distant_Recurrence_date": Field("date"),
+    "Death": Field("enum", YES_NO),
+    "Death_date": Field("date"),
+    "Cancer_Related_Death": Field("enum", YES_NO),
+    "Time_to_Local_Recurrence": Field("number"),
+    "Time_to_Regional_Recurrence": Field("number"),
+    "Time_to_Distant_Recurrence": Field("number"),
+    "Time_to_Death": Field("number"),
+}
+
+# Keys written by earlier versions of the form, mapped to their schema column
+LEGACY_ALIASES = {
+    "Dose": "Dose_per_Fraction",
+    "Overall_Tolerance": "Overal_tolerance",
+    "Local Recurrence": "Local_Recurrence",
+    "Regional_recurrence": "Regional_Recurrence",
+    "Distant_recurrence": "Distant_Recurrence",
+    "Cancer Related Death": "Cancer_Related_Death",
+    "Time_to_local_recurrence": "Time_to_Local_Recurrence",
+    "Time_to_regional_recurrence": "Time_to_Regional_Recurrence",
+    "Time_to_distant_recurrence": "Time_to_Distant_Recurrence",
+    "time_to_death": "Time_to_Death",
+}
+
+REGISTRY_COLUMNS = list(SCHEMA)
+DATE_COLUMNS = [name for name, field in SCHEMA.items() if field.kind == "date"]
+NUMERIC_COLUMNS = [name for name, field in SCHEMA.items() if field.kind == "number"]
+LIST_COLUMNS = [name for name, field in SCHEMA.items() if field.kind == "multi"]
+CATEGORICAL_COLUMNS = [name for name, field in SCHEMA.items() if field.kind == "enum"]
+TOXICITY_COLUMNS = [
+    "Fatigue", "Dysuria", "Cystitis", "Bladder_Perforation", "Hematuria", "Urinary_Fistula", "Urinary_Obstruction",
+    "Ureteral_Stenosis", "Urinary_Retention", "Diarrhea", "Nausea", "Bowel_Perforation", "Bowel_Obstruction",
+    "Proctitis", "Rectal_Fistula", "Rectal_Hemorrhage", "Rectal_Pain", "Rectal_Perforation", "Rectal_Stenosis",
+    "Organ_Failure", "Pneumonitis", "Esophagitis",
+]
+
+# Bitsets are int64, so a multiselect can have at most 63 options
+assert all(len(SCHEMA[name].options) <= 63 for name in LIST_COLUMNS)
+
+
+# Rename legacy keys of a stored row to their schema column
+def canonicalize(row):
+    return {LEGACY_ALIASES.get(key, key): value for key, value in row.items()}
+
+
+# Multiselect values are lists, or their string form in rows imported from Excel
+def parse_list(value):
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, str):
+        return []
+    return [item.strip() for item in value.replace("[", "").replace("]", "").replace("'", "").split(",") if item]
+
+
+# Pack a multiselect value into its bitset; unknown options are dropped
+def encode_bits(value, column):
+    options = SCHEMA[column].options
+    bits = 0
+    for item in parse_list(value):
+        if item in options:
+            bits |= 1 << options.index(item)
+    return bits
+
+
+def decode_bits(bits, column):
+    options = SCHEMA[column].options
+    return [option for position, option in enumerate(options) if bits >> position & 1]
+
+
+# Boolean mask of the rows whose encoded multiselect contains `option`
+def has_option(series, column, option):
+    return (series & (1 << SCHEMA[column].options.index(option))) != 0
+
+
+def _missing(series):
+    return series.isna() | series.isin(MISSING_VALUES)
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return str(value)
+
+
+# A frame's values as the form stores them: numbers as ints or floats, dates as
+# "%Y-%m-%d" strings and multiselects as lists. Missing markers and values that
+# do not parse are kept as they are, so validate still reports them.
+def stored_frame(df):
+    import pandas as pd
+
+    df = df.copy()
+    for column in df.columns:
+        field = SCHEMA.get(column, Field("text"))
+        values = df[column].astype(object)
+        present = values.notna() & ~values.isin(MISSING_VALUES)
+        if field.kind == "number":
+            parsed = pd.to_numeric(values.where(present), errors="coerce")
+            parsed = parsed.map(lambda number: int(number) if float(number).is_integer() else float(number))
+            values = values.where(parsed.isna(), parsed)
+        elif field.kind == "date":
+            parsed = pd.to_datetime(values.where(present), errors="coerce", format="ISO8601")
+            values = values.where(parsed.isna(), parsed.dt.strftime("%Y-%m-%d"))
+        elif field.kind == "multi":
+            values = values.map(
+                lambda value: parse_list(value) if isinstance(value, str) and value not in MISSING_VALUES else value
+            )
+        df[column] = values
+    return df
+
+
+# Encode a registry frame with the schema types: dates as datetime64, numbers as
+# floats, enums as categoricals over their declared options and multiselects as
+# bitsets (or as lists of strings when `lists` is set, e.g. for Arrow). Columns
+# outside the schema are kept as text.
+def encode_frame(df, lists=False):
+    import pandas as pd
+
+    columns = {}
+    for column in df.columns:
+        field = SCHEMA.get(column, Field("text"))
+        values = df[column]
+        if field.kind == "date":
+            columns[column] = pd.to_datetime(values.mask(_missing(values)), errors="coerce", format="ISO8601")
+        elif field.kind == "number":
+            columns[column] = pd.to_numeric(values.mask(_missing(values)), errors="coerce")
+        elif field.kind == "enum":
+            columns[column] = pd.Categorical(values, categories=field.options)
+        elif field.kind == "multi" and lists:
+            columns[column] = values.map(lambda value: [str(item) for item in parse_list(value)])
+        elif field.kind == "multi":
+            columns[column] = values.map(lambda value: encode_bits(value, column)).astype("int64")
+        else:
+            columns[column] = values.map(_text).astype(object)
+    return pd.DataFrame(columns, index=df.index)
+
+
+# Check a registry frame against the schema, one vectorized pass per column.
+# Returns one row per offending value.
+def validate(df):
+    import pandas as pd
+
+    problems = []
+    for column, field in SCHEMA.items():
+        if column not in df.columns or field.kind == "text":
+            continue
+        values = df[column]
+        present = ~_missing(values)
+        if field.kind == "date":
+            bad = present & pd.to_datetime(values.where(present), errors="coerce", format="ISO8601").isna()
+        elif field.kind == "number":
+            bad = present & pd.to_numeric(values.where(present), errors="coerce").isna()
+        elif field.kind == "enum":
+            bad = present & ~values.isin(field.options)
+        else:
+            bad = values.map(lambda value: any(item not in field.options for item in parse_list(value)))
+        for index in df.index[bad.to_numpy(dtype=bool)]:
+            problems.append({
+                "row": index,
+                "MRN": df.at[index, "MRN"] if "MRN" in df.columns else None,
+                "column": column,
+                "value": values[index],
+            })
+    return pd.DataFrame(problems, columns=["row", "MRN", "column", "value"])
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from .schema import SCHEMA, has_option, parse_list
+
+# Columns with an inverted index (option -> patients) and with a sorted date
+# index. Enum and multiselect columns can go in the first list, date columns in
+# the second.
+INDEXED_COLUMNS = [
+    "Histology", "Location", "Grade", "Recurrent_Tumor", "Local_Recurrence", "Regional_Recurrence",
+    "Distant_Recurrence", "Death",
+]
+DATE_INDEXED_COLUMNS = ["Biopsy_date", "Surgery_date", "Date_of_Last_Radiotherapy"]
+RESULT_COLUMNS = ["MRN"] + INDEXED_COLUMNS[:3] + DATE_INDEXED_COLUMNS + INDEXED_COLUMNS[3:]
+
+
+# In-memory indexes over the current state of every patient, built once per
+# registry generation:
+# - MRNs sorted, so a prefix is a range found by binary search
+# - an inverted index from each enum/multiselect option to the patients having it
+# - each date column sorted, so a date window is a range found by binary search
+# A search combines them as boolean masks: options of one column are OR-ed,
+# different columns and date windows are AND-ed.
+class SearchIndex:
+    def __init__(self, current, encoded, generation=0):
+        self.generation = generation
+        self.size = len(current)
+        mrns = current["MRN"].astype(str).to_numpy() if self.size else np.array([], dtype=str)
+        self._mrn_order = np.argsort(mrns, kind="stable")
+        self._mrns = mrns[self._mrn_order]
+
+        self._postings = {}
+        for column in INDEXED_COLUMNS:
+            if column not in encoded:
+                continue
+            values = encoded[column]
+            field = SCHEMA[column]
+            if field.kind == "multi":
+                masks = {option: has_option(values, column, option) for option in field.options}
+            else:
+                masks = {option: values == option for option in field.options}
+            self._postings[column] = {
+                option: np.flatnonzero(mask.to_numpy()) for option, mask in masks.items() if mask.any()
+            }
+
+        self._dates = {}
+        for column in DATE_INDEXED_COLUMNS:
+            if column not in encoded:
+                continue
+            values = encoded[column].to_numpy(dtype="datetime64[ns]")
+            positions = np.flatnonzero(~np.isnat(values))
+            order = np.argsort(values[positions], kind="stable")
+            self._dates[column] = (values[positions][order], positions[order])
+
+        results = current.reindex(columns=RESULT_COLUMNS).reset_index(drop=True)
+        results["Histology"] = results["Histology"].map(lambda value: ", ".join(parse_list(value)))
+        self.results = results
+
+    # Options that occur in an indexed column, with their patient counts
+    def options(self, column):
+        return {option: len(positions) for option, positions in self._postings.get(column, {}).items()}
+
+    def _mask(self, positions):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def _prefix_range(self, prefix):
+        prefix = str(prefix).strip()
+        start = np.searchsorted(self._mrns, prefix, side="left")
+        end = np.searchsorted(self._mrns, prefix + "\U0010ffff", side="left")
+        return start, end
+
+    # Positions of the patients whose MRN starts with `prefix`, in MRN order
+    def mrn_prefix(self, prefix):
+        start, end = self._prefix_range(prefix)
+        return self._mrn_order[start:end]
+
+    # MRNs starting with `prefix`, for typeahead
+    def complete(self, prefix, limit=10):
+        start, end = self._prefix_range(prefix)
+        return self._mrns[start:min(end, start + limit)].tolist()
+
+    # Positions of the patients with a date in [start, end]; either bound may be None
+    def date_range(self, column, start=None, end=None):
+        values, positions = self._dates[column]
+        low = np.searchsorted(values, np.datetime64(pd.Timestamp(start), "ns"), side="left") if start else 0
+        high = np.searchsorted(values, np.datetime64(pd.Timestamp(end), "ns"), side="right") if end else len(values)
+        return positions[low:high]
+
+    # Patients matching every given criterion, as rows of `results` in MRN order.
+    # `filters` maps indexed columns to accepted options, `dates` maps date
+    # columns to (start, end).
+    def search(self, mrn_prefix=None, filters=None, dates=None, limit=None):
+        mask = np.ones(self.size, dtype=bool)
+        if mrn_prefix:
+            mask &= self._mask(self.mrn_prefix(mrn_prefix))
+        for column, options in (filters or {}).items():
+            if options:
+                postings = self._postings.get(column, {})
+                mask &= self._mask(np.concatenate([postings.get(option, []) for option in options]).astype(int))
+        for column, (start, end) in (dates or {}).items():
+            if start or end:
+                mask &= self._mask(self.date_range(column, start, end))
+        positions = self._mrn_order[mask[self._mrn_order]]
+        if limit is not None:
+            positions = positions[:limit]
+        return self.results.iloc[positions]
+
+
+# Search index over a registry's current state
+def build_index(registry):
+    return SearchIndex(registry.current_frame(), registry.current_frame(encoded=True), registry.generation)
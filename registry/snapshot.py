@@ -0,0 +1,72 @@
+import argparse
+import os
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from .schema import encode_frame
+from .storage import Registry
+
+# Columnar snapshot of the registry for analysis. The default is an uncompressed
+# Arrow IPC file, which readers memory-map and read without copying; a .parquet
+# path writes Parquet instead.
+snapshot_file = "registry.arrow"
+
+
+def _to_table(df, generation):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"registry_generation"] = str(generation).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+# Write every visit of the registry to a snapshot file; the file is replaced
+# atomically so readers never see a half-written snapshot
+def write_snapshot(path=None, registry=None):
+    path = path or snapshot_file
+    registry = registry or Registry()
+    table = _to_table(encode_frame(registry.frame(), lists=True), registry.generation)
+    temporary = path + ".tmp"
+    if path.endswith(".parquet"):
+        pq.write_table(table, temporary)
+    else:
+        feather.write_feather(table, temporary, compression="uncompressed")
+    os.replace(temporary, path)
+    return path
+
+
+# Read selected columns as an Arrow table. Arrow files are memory-mapped, so
+# only the pages of the requested columns are touched and nothing is copied.
+def read_snapshot_table(columns=None, path=None):
+    path = path or snapshot_file
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+# Read selected columns as a pandas DataFrame
+def read_snapshot(columns=None, path=None):
+    return read_snapshot_table(columns, path).to_pandas()
+
+
+# Registry generation (highest visit id) the snapshot was written at
+def snapshot_generation(path=None):
+    path = path or snapshot_file
+    if path.endswith(".parquet"):
+        metadata = pq.read_schema(path).metadata
+    else:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata
+    return int(metadata[b"registry_generation"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a columnar snapshot of the registry")
+    parser.add_argument("path", nargs="?", default=snapshot_file, help="output file (.arrow or .parquet)")
+    args = parser.parse_args(argv)
+    write_snapshot(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,867 @@
+import argparse
+import bisect
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import closing, contextmanager
+from datetime import date, datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .schema import (
+    MISSING_VALUES, REGISTRY_COLUMNS, SCHEMA, TOXICITY_COLUMNS, TOXICITY_SEVERITY, canonicalize, encode_frame, validate,
+)
+
+logger = logging.getLogger(__name__)
+
+# File paths for local storage: the SQLite database is the system of record,
+# the Excel workbook is only written on export (and read once for migration)
+database_file = "registry.sqlite3"
+excel_file = ""
+
+# Rebuild the patients and current_state tables by replaying every visit
+def rebuild_current_state(conn):
+    conn.execute("DELETE FROM current_state")
+    conn.execute("DELETE FROM patients")
+    visits = [(visit_id, _decode(data)) for visit_id, data in conn.execute("SELECT id, data FROM visits ORDER BY id")]
+    for visit_id, row in visits:
+        row["MRN"] = normalize_mrn(row.get("MRN"))
+    _update_patients(conn, visits)
+
+
+# Rewrite stored visits as deltas against the patient's previous state,
+# a few hundred patients at a time
+def delta_encode_visits(conn):
+    mrns = [mrn for (mrn,) in conn.execute("SELECT DISTINCT mrn FROM visits ORDER BY mrn")]
+    for visits in _batches(conn, "SELECT id, data FROM visits WHERE mrn IN ({}) ORDER BY id", mrns):
+        states, updates = {}, []
+        for visit_id, data in visits.fetchall():
+            row = _decode(data)
+            mrn = normalize_mrn(row.get("MRN"))
+            delta = diff_state(states.get(mrn), row)
+            states[mrn] = merge_state(states.get(mrn), row)
+            if delta != row:
+                updates.append((_encode(delta), visit_id))
+        conn.executemany("UPDATE visits SET data = ? WHERE id = ?", updates)
+    conn.execute("UPDATE registry_meta SET value = value + 1 WHERE key = 'epoch'")
+
+
+# Rebuild the toxicity aggregates by replaying every visit
+def rebuild_toxicity_counts(conn):
+    conn.execute("DELETE FROM toxicity_counts")
+    conn.execute("DELETE FROM toxicity_worst")
+    visits = [(visit_id, _decode(data)) for visit_id, data in conn.execute("SELECT id, data FROM visits ORDER BY id")]
+    for visit_id, row in visits:
+        row["MRN"] = normalize_mrn(row.get("MRN"))
+    _update_toxicity_counts(conn, visits, {})
+
+
+# Schema versions, applied in order. Each visit is one append-only row whose
+# payload is JSON holding the fields the visit changed (see diff_state);
+# patients and current_state are derived from the visits and updated on
+# every save.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS visits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mrn TEXT NOT NULL,
+        saved_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS visits_mrn ON visits (mrn);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS patients (
+        mrn TEXT PRIMARY KEY,
+        first_visit_id INTEGER NOT NULL,
+        last_visit_id INTEGER NOT NULL,
+        visit_count INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS current_state (
+        mrn TEXT PRIMARY KEY REFERENCES patients (mrn),
+        visit_id INTEGER NOT NULL,
+        data TEXT NOT NULL
+    );
+    """,
+    rebuild_current_state,
+    # Current states built before the schema are rebuilt with canonical column names
+    rebuild_current_state,
+    # The epoch changes whenever stored visits are rewritten rather than appended
+    """
+    CREATE TABLE IF NOT EXISTS registry_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO registry_meta (key, value) VALUES ('epoch', 0);
+    """,
+    # Visits keep only the fields that changed, with who saved them
+    "ALTER TABLE visits ADD COLUMN author TEXT",
+    delta_encode_visits,
+    # Patients per toxicity, worst grade, regimen and location, kept up to date
+    # on every save so toxicity reports never scan the visits
+    """
+    CREATE TABLE IF NOT EXISTS toxicity_worst (
+        mrn TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS toxicity_counts (
+        toxicity TEXT NOT NULL,
+        grade TEXT NOT NULL,
+        regimen TEXT NOT NULL,
+        location TEXT NOT NULL,
+        patients INTEGER NOT NULL,
+        PRIMARY KEY (toxicity, grade, regimen, location)
+    );
+    """,
+    rebuild_toxicity_counts,
+    # Corrections to stored visits: the delta a visit had before each one (so
+    # past states and the original entries can still be read back) and the
+    # fields it changed, with when and by whom it was made
+    """
+    CREATE TABLE IF NOT EXISTS corrections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        visit_id INTEGER NOT NULL REFERENCES visits (id),
+        mrn TEXT NOT NULL,
+        corrected_at TEXT NOT NULL,
+        author TEXT,
+        previous TEXT NOT NULL,
+        changes TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS corrections_mrn ON corrections (mrn);
+    """,
+    # Worst grades used to be ranked by option order, which put "Absent" above "Present"
+    rebuild_toxicity_counts,
+]
+
+
+# Exclusive lock shared by every process writing to the database at `path`.
+# SQLite serializes transactions itself; the lock additionally keeps schema
+# migrations and batch jobs from interleaving with the app's writer.
+@contextmanager
+def file_lock(path=None):
+    with open((path or database_file) + ".lock", "a+") as handle:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Apply the pending migrations. Each one is committed together with its
+# version bump, so a crash can never leave a step applied but unrecorded (and
+# re-run a step such as ALTER TABLE that cannot run twice).
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            if callable(migration):
+                conn.execute("BEGIN")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            else:
+                conn.executescript(f"BEGIN; {migration}; PRAGMA user_version = {number}; COMMIT;")
+        except BaseException:
+            conn.rollback()
+            raise
+    if version == 0:
+        _import_legacy_excel(conn)
+
+
+# Open the database, creating or upgrading the tables if needed. WAL mode lets
+# readers carry on while a write is being committed.
+def connect(path=None, **kwargs):
+    path = path or database_file
+    conn = sqlite3.connect(path, timeout=30, **kwargs)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        with file_lock(path):
+            conn.execute("PRAGMA journal_mode = WAL")
+            _migrate(conn)
+    return conn
+
+
+@contextmanager
+def _open(path=None):
+    with closing(connect(path)) as conn:
+        with conn:
+            yield conn
+
+
+# Write transaction for batch jobs: visits recorded with record_visits inside
+# it are committed together, or not at all, while holding the writer lock
+@contextmanager
+def transaction(path=None):
+    # Connect (and migrate) before locking: migrating takes the lock itself
+    with closing(connect(path)) as conn, file_lock(path), conn:
+        yield conn
+
+
+# Convert values that json cannot encode (dates, numpy scalars)
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def _encode(data):
+    return json.dumps(data, default=_json_default)
+
+
+def _decode(data):
+    return canonicalize(json.loads(data))
+
+
+# MRNs are compared as stripped strings everywhere
+def normalize_mrn(mrn):
+    return str(mrn).strip()
+
+
+# Run `query` for `values` in batches of at most 500, the "{}" in its IN clause
+# standing for one batch; yields one cursor per batch. `params` come before it.
+def _batches(conn, query, values, *params):
+    values = list(values)
+    for start in range(0, len(values), 500):
+        batch = values[start:start + 500]
+        yield conn.execute(query.format(", ".join("?" * len(batch))), [*params, *batch])
+
+
+# A patient's current state is every visit merged in order; fields a visit
+# leaves empty keep their earlier value
+def merge_state(state, visit):
+    state = dict(state or {})
+    state.update((key, value) for key, value in visit.items() if value is not None)
+    return state
+
+
+# The part of a visit that changes the patient's state, as stored: merging it
+# gives the same state as merging the whole visit. The MRN is always kept.
+def diff_state(state, visit):
+    state = state or {}
+    delta = {key: value for key, value in visit.items() if value is not None and state.get(key) != value}
+    delta["MRN"] = visit["MRN"]
+    return delta
+
+
+# Replay delta-encoded visits [(visit_id, delta)], oldest first, into full
+# rows: the patient's state right after each visit. `states` holds the states
+# before the first visit and is updated in place.
+def replay(visits, states):
+    for visit_id, delta in visits:
+        mrn = normalize_mrn(delta.get("MRN"))
+        states[mrn] = merge_state(states.get(mrn), delta)
+        yield visit_id, states[mrn]
+
+
+# States of the patients `mrns` after every visit up to `visit_id`, and how
+# many visits each of them had by then
+def _states_before(conn, mrns, visit_id):
+    states, counts = {}, Counter()
+    query = "SELECT id, data FROM visits WHERE id <= ? AND mrn IN ({}) ORDER BY id"
+    for visits in _batches(conn, query, sorted(mrns), visit_id):
+        for _, state in replay(((key, _decode(data)) for key, data in visits), states):
+            counts[normalize_mrn(state.get("MRN"))] += 1
+    return states, counts
+
+
+# Current states of the patients `mrns` as stored in current_state
+def _current_states(conn, mrns):
+    states = {}
+    for rows in _batches(conn, "SELECT mrn, data FROM current_state WHERE mrn IN ({})", sorted(mrns)):
+        states.update((mrn, _decode(data)) for mrn, data in rows)
+    return states
+
+
+# Fold visits [(visit_id, row)] into the patients and current_state tables,
+# starting from `states` when the caller already loaded them
+def _update_patients(conn, visits, states=None):
+    if states is None:
+        states = _current_states(conn, {row["MRN"] for _, row in visits})
+    patients = {}
+    for visit_id, row in visits:
+        mrn = row["MRN"]
+        states[mrn] = merge_state(states.get(mrn), row)
+        first_visit_id, _, count = patients.get(mrn, (visit_id, visit_id, 0))
+        patients[mrn] = (first_visit_id, visit_id, count + 1)
+    conn.executemany(
+        """
+        INSERT INTO patients (mrn, first_visit_id, last_visit_id, visit_count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (mrn) DO UPDATE SET
+            last_visit_id = excluded.last_visit_id, visit_count = visit_count + excluded.visit_count
+        """,
+        [(mrn, first, last, count) for mrn, (first, last, count) in patients.items()],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO current_state (mrn, visit_id, data) VALUES (?, ?, ?)",
+        [(mrn, last, _encode(states[mrn])) for mrn, (_, last, _) in patients.items()],
+    )
+
+
+# Radiotherapy regimen of a patient state, e.g. "2 Gy x 25"
+def regimen(state):
+    dose, fractions = state.get("Dose_per_Fraction"), state.get("Fractionation")
+    if dose in MISSING_VALUES + [None] or fractions in MISSING_VALUES + [None]:
+        return "Unknown"
+    return f"{_number(dose)} Gy x {_number(fractions)}"
+
+
+def _number(value):
+    try:
+        return f"{float(value):g}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# Worst grade of every toxicity after a visit, ranked by TOXICITY_SEVERITY;
+# values outside the column's options are ignored
+def worst_grades(worst, visit):
+    worst = dict(worst or {})
+    for column in TOXICITY_COLUMNS:
+        grade = visit.get(column)
+        if grade in SCHEMA[column].options and (
+            column not in worst or TOXICITY_SEVERITY.index(grade) > TOXICITY_SEVERITY.index(worst[column])
+        ):
+            worst[column] = grade
+    return worst
+
+
+# The toxicity_counts keys a patient is counted under
+def _toxicity_keys(state, worst):
+    if not state or not worst:
+        return []
+    location = state.get("Location")
+    location = "Unknown" if location in MISSING_VALUES + [None] else str(location)
+    return [(column, grade, regimen(state), location) for column, grade in worst.items()]
+
+
+# Move the patients of visits [(visit_id, row)] between toxicity_counts keys:
+# each patient's old key is decremented and the new one incremented, so a save
+# touches one row per toxicity whatever the registry size. `states` holds the
+# patients' states before the visits and is not modified.
+def _update_toxicity_counts(conn, visits, states):
+    mrns = sorted({row["MRN"] for _, row in visits})
+    worst = {}
+    for rows in _batches(conn, "SELECT mrn, data FROM toxicity_worst WHERE mrn IN ({})", mrns):
+        worst.update((mrn, json.loads(data)) for mrn, data in rows)
+    new_states, new_worst = {}, dict(worst)
+    for _, row in visits:
+        mrn = row["MRN"]
+        new_states[mrn] = merge_state(new_states.get(mrn, states.get(mrn)), row)
+        new_worst[mrn] = worst_grades(new_worst.get(mrn), row)
+    changes = Counter()
+    for mrn in mrns:
+        changes.subtract(_toxicity_keys(states.get(mrn), worst.get(mrn)))
+        changes.update(_toxicity_keys(new_states[mrn], new_worst[mrn]))
+    changes = [key + (count,) for key, count in changes.items() if count]
+    conn.executemany(
+        """
+        INSERT INTO toxicity_counts (toxicity, grade, regimen, location, patients) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (toxicity, grade, regimen, location) DO UPDATE SET patients = patients + excluded.patients
+        """,
+        changes,
+    )
+    conn.executemany(
+        "DELETE FROM toxicity_counts WHERE toxicity = ? AND grade = ? AND regimen = ? AND location = ? AND patients = 0",
+        [change[:4] for change in changes if change[4] < 0],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO toxicity_worst (mrn, data) VALUES (?, ?)",
+        [(mrn, json.dumps(new_worst[mrn])) for mrn in mrns if new_worst[mrn]],
+    )
+
+
+# Append visits, stored as deltas, and bring the patients' current states up
+# to date; `author` is recorded with each visit for the audit trail. The
+# caller owns the transaction (see `transaction`).
+def record_visits(conn, rows, author=None):
+    saved_at = datetime.now().isoformat(timespec="milliseconds")
+    rows = [json.loads(_encode(canonicalize(row))) for row in rows]
+    for row in rows:
+        row["MRN"] = normalize_mrn(row["MRN"])
+    states = _current_states(conn, {row["MRN"] for row in rows})
+    previous = dict(states)
+    visits = []
+    for row in rows:
+        delta = diff_state(previous.get(row["MRN"]), row)
+        previous[row["MRN"]] = merge_state(previous.get(row["MRN"]), delta)
+        visit_id = conn.execute(
+            "INSERT INTO visits (mrn, saved_at, author, data) VALUES (?, ?, ?, ?)",
+            (row["MRN"], saved_at, author, _encode(delta)),
+        ).lastrowid
+        visits.append((visit_id, delta))
+    _update_toxicity_counts(conn, visits, states)
+    _update_patients(conn, visits, states)
+    return [visit_id for visit_id, _ in visits]
+
+
+# Build a DataFrame from decoded visit payloads, registry columns first
+def _to_frame(rows):
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    extra = [column for column in df.columns if column not in REGISTRY_COLUMNS]
+    df = df.reindex(columns=REGISTRY_COLUMNS + extra)
+    df["MRN"] = df["MRN"].astype(str)
+    return df
+
+
+# Validate rows against the schema and log what does not match
+def _check(df):
+    problems = validate(df)
+    if len(problems):
+        logger.warning(
+            "%d registry values do not match the schema (columns: %s)",
+            len(problems), ", ".join(sorted(problems["column"].unique())),
+        )
+    return problems
+
+
+# One-time migration of an existing Excel registry into the database
+def _import_legacy_excel(conn):
+    if not excel_file or not os.path.exists(excel_file):
+        return
+    import pandas as pd
+
+    legacy = pd.read_excel(excel_file, dtype={"MRN": str})
+    rows = [
+        {key: value for key, value in row.items() if pd.notna(value)}
+        for row in legacy.to_dict("records")
+    ]
+    with conn:
+        record_visits(conn, rows)
+
+
+# Load existing data or create a new DataFrame
+def load_data():
+    with _open() as conn:
+        visits = ((visit_id, _decode(data)) for visit_id, data in conn.execute("SELECT id, data FROM visits ORDER BY id"))
+        rows = [row for _, row in replay(visits, {})]
+    df = _to_frame(rows)
+    _check(df)
+    return df
+
+
+# Function to save patient data (Appending Instead of Overwriting)
+def save_data(data, author=None):
+    data["MRN"] = normalize_mrn(data["MRN"])
+    return get_writer().submit([data], author).result()[0]
+
+
+# Save many visits in a single transaction
+def save_many(rows, author=None):
+    return get_writer().submit(rows, author).result()
+
+
+# Single writer per database and process. Saves are queued; the writer thread
+# drains everything queued so far and commits it as one transaction under the
+# file lock, so concurrent saves cost one commit instead of one each. If a
+# batch fails, its saves are retried one by one so a bad row only fails its
+# own save.
+class Writer:
+    def __init__(self, path=None):
+        self.path = path or database_file
+        # Connect here so a database that cannot be opened fails the caller
+        # instead of the writer thread, which would leave saves waiting forever
+        self._conn = connect(self.path, check_same_thread=False)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="registry-writer", daemon=True)
+        self._thread.start()
+
+    # Queue visits for saving; the future resolves to their visit ids
+    def submit(self, rows, author=None):
+        future = Future()
+        self._queue.put((list(rows), author, future))
+        return future
+
+    def _run(self):
+        conn = self._conn
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(conn, batch)
+            except Exception:
+                for item in batch:
+                    try:
+                        self._commit(conn, [item])
+                    except Exception as error:
+                        item[-1].set_exception(error)
+
+    def _commit(self, conn, batch):
+        with file_lock(self.path), conn:
+            visit_ids = [record_visits(conn, rows, author) for rows, author, _ in batch]
+        for ids, (_, _, future) in zip(visit_ids, batch):
+            future.set_result(ids)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+# The process-wide writer for a database
+def get_writer(path=None):
+    path = path or database_file
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = Writer(path)
+        return _writers[path]
+
+
+# Every visit with its stored fields, indexed by visit id
+def load_visits():
+    import pandas as pd
+
+    with _open() as conn:
+        visits = conn.execute("SELECT id, data FROM visits ORDER BY id").fetchall()
+    visits = list(replay(((visit_id, _decode(data)) for visit_id, data in visits), {}))
+    df = _to_frame([row for _, row in visits])
+    df.index = pd.Index([visit_id for visit_id, _ in visits], name="visit_id")
+    return df
+
+
+# Correct fields of stored visits ({visit_id: {column: value}}) for maintenance
+# such as recomputing derived columns. Later visits of the same patients carry
+# a corrected field forward unless they stored that field themselves. Every
+# visit whose stored delta has to change gets a row in corrections, attributed
+# to `author`, holding its old delta and the fields whose values changed, so the
+# audit trail and state_at still show what was originally saved. Current states
+# are rebuilt and the epoch is bumped so cached registries reload instead of
+# only appending.
+def rewrite_visits(updates, author=None):
+    corrected_at = datetime.now().isoformat(timespec="milliseconds")
+    with transaction() as conn:
+        mrns = set()
+        for rows in _batches(conn, "SELECT DISTINCT mrn FROM visits WHERE id IN ({})", updates):
+            mrns.update(mrn for (mrn,) in rows)
+        for visits in _batches(conn, "SELECT id, data FROM visits WHERE mrn IN ({}) ORDER BY id", sorted(mrns)):
+            old_states, new_states, changes, corrections = {}, {}, [], []
+            for visit_id, data in visits.fetchall():
+                stored = _decode(data)
+                mrn = stored["MRN"] = normalize_mrn(stored.get("MRN"))
+                old = old_states[mrn] = merge_state(old_states.get(mrn), stored)
+                row = {**stored, **updates.get(visit_id, {})}
+                previous = new_states.get(mrn)
+                new = new_states[mrn] = merge_state(previous, row)
+                # The stored delta still gives the corrected state: leave the visit as it is
+                if merge_state(previous, stored) == new:
+                    continue
+                changed = {column: [old.get(column), value] for column, value in new.items() if old.get(column) != value}
+                changes.append((_encode(diff_state(previous, row)), visit_id))
+                corrections.append((visit_id, mrn, corrected_at, author, data, _encode(changed)))
+            conn.executemany("UPDATE visits SET data = ? WHERE id = ?", changes)
+            conn.executemany(
+                """
+                INSERT INTO corrections (visit_id, mrn, corrected_at, author, previous, changes)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                corrections,
+            )
+        rebuild_current_state(conn)
+        rebuild_toxicity_counts(conn)
+        conn.execute("UPDATE registry_meta SET value = value + 1 WHERE key = 'epoch'")
+
+
+# Stream stored visits with an id above `since` (a watermark from an earlier
+# read), oldest first, as lists of at most `size` (visit_id, row) pairs, so a
+# whole-registry read holds one chunk in memory at a time: the states the
+# chunk's deltas are replayed from are read again for each chunk, from the
+# visits of that chunk's patients only. With `current`, the
+# patients' current states are streamed instead, keyed by their last visit id.
+# With `numbered`, (visit_id, number, row) triples are yielded instead, where
+# number counts the patient's visits from 1 (None for current states).
+def iter_visits(since=0, size=5000, current=False, numbered=False):
+    if current:
+        query = "SELECT visit_id, data FROM current_state WHERE visit_id > ? ORDER BY visit_id"
+    else:
+        query = "SELECT id, data FROM visits WHERE id > ? ORDER BY id"
+    with _open() as conn:
+        cursor = conn.execute(query, (since,))
+        while True:
+            chunk = cursor.fetchmany(size)
+            if not chunk:
+                break
+            visit_ids = [visit_id for visit_id, _ in chunk]
+            rows = [_decode(data) for _, data in chunk]
+            numbers = [None] * len(rows)
+            if not current:
+                # Visits are deltas: replay them from each patient's state before the chunk
+                mrns = [normalize_mrn(row.get("MRN")) for row in rows]
+                states, counts = _states_before(conn, set(mrns), visit_ids[0] - 1)
+                for offset, mrn in enumerate(mrns):
+                    counts[mrn] += 1
+                    numbers[offset] = counts[mrn]
+                rows = [row for _, row in replay(zip(visit_ids, rows), states)]
+            if numbered:
+                yield list(zip(visit_ids, numbers, rows))
+            else:
+                yield list(zip(visit_ids, rows))
+
+
+# One row per patient holding the latest merged state
+def load_current():
+    with _open() as conn:
+        rows = [_decode(data) for (data,) in conn.execute("SELECT data FROM current_state ORDER BY mrn")]
+    return _to_frame(rows)
+
+
+# Every visit of one patient, oldest first
+def load_history(mrn):
+    with _open() as conn:
+        visits = conn.execute("SELECT id, data FROM visits WHERE mrn = ? ORDER BY id", (normalize_mrn(mrn),))
+        rows = [row for _, row in replay(((visit_id, _decode(data)) for visit_id, data in visits), {})]
+    return _to_frame(rows)
+
+
+# State of a patient as it was at `when` (a datetime, a date meaning the end
+# of that day, or an ISO timestamp), or None if nothing was saved by then
+def state_at(mrn, when):
+    if isinstance(when, datetime):
+        when = when.isoformat(timespec="milliseconds")
+    elif isinstance(when, date):
+        when = f"{when.isoformat()}T23:59:59.999"
+    state = None
+    with _open() as conn:
+        # Visits corrected since `when` are read as stored before their first later correction
+        stored = dict(conn.execute(
+            "SELECT visit_id, previous FROM corrections WHERE mrn = ? AND corrected_at > ? ORDER BY id DESC",
+            (normalize_mrn(mrn), when),
+        ))
+        for visit_id, data in conn.execute(
+            "SELECT id, data FROM visits WHERE mrn = ? AND saved_at <= ? ORDER BY id", (normalize_mrn(mrn), when)
+        ):
+            state = merge_state(state, _decode(stored.get(visit_id, data)))
+    return state
+
+
+# Patients per toxicity, worst grade, radiotherapy regimen and location, read
+# from the aggregate table maintained on save
+def load_toxicity_counts():
+    import pandas as pd
+
+    with _open() as conn:
+        counts = conn.execute(
+            "SELECT toxicity, grade, regimen, location, patients FROM toxicity_counts ORDER BY toxicity, regimen, location"
+        ).fetchall()
+    return pd.DataFrame(counts, columns=["toxicity", "grade", "regimen", "location", "patients"])
+
+
+# Audit trail of a patient: one row per field changed by each visit, as it was
+# originally saved, and per field changed by each later correction, with when
+# and by whom; values are shown as text
+def audit_trail(mrn):
+    import pandas as pd
+
+    with _open() as conn:
+        visits = conn.execute(
+            "SELECT id, saved_at, author, data FROM visits WHERE mrn = ? ORDER BY id", (normalize_mrn(mrn),)
+        ).fetchall()
+        corrections = conn.execute(
+            "SELECT visit_id, corrected_at, author, previous, changes FROM corrections WHERE mrn = ? ORDER BY id",
+            (normalize_mrn(mrn),),
+        ).fetchall()
+    original = {}
+    for visit_id, _, _, previous, _ in corrections:
+        original.setdefault(visit_id, previous)
+    changes = [
+        (visit_id, saved_at, author, "saved", column, str(value))
+        for visit_id, saved_at, author, data in visits
+        for column, value in _decode(original.get(visit_id, data)).items()
+        if column != "MRN"
+    ]
+    changes += [
+        (visit_id, corrected_at, author, "corrected", column, str(new))
+        for visit_id, corrected_at, author, _, changed in corrections
+        for column, (_, new) in json.loads(changed).items()
+    ]
+    changes.sort(key=lambda change: (change[1], change[0]))
+    return pd.DataFrame(changes, columns=["visit_id", "saved_at", "author", "change", "column", "value"])
+
+
+# In-memory copy of the registry shared by every session of the server process.
+# The highest visit id seen acts as a write generation: each read pulls only the
+# visits added since then (by this process or any other), so the database is
+# parsed once and then kept up to date incrementally.
+class Registry:
+    def __init__(self, path=None):
+        self.path = path or database_file
+        self._lock = threading.RLock()
+        self._conn = connect(self.path, check_same_thread=False)
+        self._reset()
+
+    def _reset(self):
+        self.epoch = self._epoch()
+        self._rows = []
+        self._frame = None
+        self._index = {}
+        self._current = {}
+        self._current_frame = None
+        self._encoded = {}
+        self._problems = None
+        self.visit_ids = []
+        self.generation = 0
+
+    def _epoch(self):
+        return self._conn.execute("SELECT value FROM registry_meta WHERE key = 'epoch'").fetchone()[0]
+
+    # Pull visits written since the last refresh, or reload everything if
+    # stored visits were rewritten. Only the rows, the MRN index and the
+    # current states are updated here; frames catch up when next asked for.
+    def refresh(self):
+        with self._lock:
+            if self._epoch() != self.epoch:
+                self._reset()
+            new_visits = self._conn.execute(
+                "SELECT id, data FROM visits WHERE id > ? ORDER BY id", (self.generation,)
+            ).fetchall()
+            if not new_visits:
+                return self
+            visits = replay(((visit_id, _decode(data)) for visit_id, data in new_visits), self._current)
+            for offset, (visit_id, row) in enumerate(visits, start=len(self._rows)):
+                self._index.setdefault(normalize_mrn(row.get("MRN")), []).append(offset)
+                self._rows.append(row)
+                self.visit_ids.append(visit_id)
+            self._current_frame = None
+            self._encoded.pop("current", None)
+            self.generation = new_visits[-1][0]
+            return self
+
+    # Registry as a DataFrame, or schema-encoded with `encoded`; shared between
+    # sessions, so treat it as read-only. Visits added since the last call are
+    # converted, validated and concatenated onto the cached frame.
+    def frame(self, encoded=False):
+        with self._lock:
+            self.refresh()
+            framed = len(self._frame) if self._frame is not None else 0
+            if framed < len(self._rows):
+                import pandas as pd
+
+                new_frame = _to_frame(self._rows[framed:])
+                new_frame.index += framed
+                problems = _check(new_frame)
+                self._problems = problems if self._problems is None else pd.concat([self._problems, problems], ignore_index=True)
+                self._frame = new_frame if self._frame is None else pd.concat([self._frame, new_frame])
+                if "visits" in self._encoded:
+                    self._encoded["visits"] = pd.concat([self._encoded["visits"], encode_frame(new_frame)])
+            elif self._frame is None:
+                self._frame = _to_frame([])
+                self._problems = _check(self._frame)
+            if not encoded:
+                return self._frame
+            if "visits" not in self._encoded:
+                self._encoded["visits"] = encode_frame(self._frame)
+            return self._encoded["visits"]
+
+    # Stored values that do not match the schema, one row per value
+    @property
+    def problems(self):
+        with self._lock:
+            self.frame()
+            return self._problems
+
+    # One row per patient with the current state; shared, so treat it as read-only
+    def current_frame(self, encoded=False):
+        with self._lock:
+            self.refresh()
+            if self._current_frame is None:
+                self._current_frame = _to_frame(list(self._current.values()))
+            if not encoded:
+                return self._current_frame
+            if "current" not in self._encoded:
+                self._encoded["current"] = encode_frame(self._current_frame)
+            return self._encoded["current"]
+
+    # Current state of one patient, or None for an unknown MRN
+    def current(self, mrn):
+        with self._lock:
+            self.refresh()
+            state = self._current.get(normalize_mrn(mrn))
+            return dict(state) if state is not None else None
+
+    # Current states of many patients from a single refresh, so they come from
+    # one consistent version of the registry; None for unknown MRNs
+    def current_many(self, mrns):
+        with self._lock:
+            self.refresh()
+            states = {}
+            for mrn in mrns:
+                state = self._current.get(normalize_mrn(mrn))
+                states[normalize_mrn(mrn)] = dict(state) if state is not None else None
+            return states
+
+    # All visits of a patient, oldest first, found through the MRN index
+    def lookup(self, mrn):
+        with self._lock:
+            self.refresh()
+            return [dict(self._rows[offset]) for offset in self._index.get(normalize_mrn(mrn), [])]
+
+    # Visits with an id above `since`, oldest first, as at most `limit`
+    # (visit_id, row) pairs; the last id is the watermark for the next page
+    def visits_since(self, since=0, limit=None):
+        with self._lock:
+            self.refresh()
+            start = bisect.bisect_right(self.visit_ids, since)
+            end = len(self.visit_ids) if limit is None else start + limit
+            return [(visit_id, dict(row)) for visit_id, row in zip(self.visit_ids[start:end], self._rows[start:end])]
+
+    # Append one visit through the process-wide writer and fold it into the
+    # cached rows. The registry lock is not held while waiting for the writer,
+    # so saves from concurrent sessions share a commit.
+    def append(self, data, author=None):
+        data["MRN"] = normalize_mrn(data["MRN"])
+        visit_id = get_writer(self.path).submit([data], author).result()[0]
+        self.refresh()
+        return visit_id
+
+
+# Write the whole registry to an Excel workbook, replacing any existing file
+# atomically so a crash never leaves a half-written workbook behind
+def export_excel(path=None):
+    path = path or excel_file
+    df = load_data()
+    for column in df.columns:
+        df[column] = df[column].map(lambda value: str(value) if isinstance(value, list) else value)
+    root, extension = os.path.splitext(path)
+    temporary = f"{root}.tmp{extension}"
+    df.to_excel(temporary, index=False)
+    os.replace(temporary, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registry storage maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export = subcommands.add_parser("export-excel", help="write the registry to an .xlsx file")
+    export.add_argument("path")
+    subcommands.add_parser("rebuild-toxicity", help="rebuild the toxicity aggregates from the stored visits")
+    args = parser.parse_args(argv)
+
+    if args.command == "export-excel":
+        export_excel(args.path)
+    elif args.command == "rebuild-toxicity":
+        with transaction() as conn:
+            rebuild_toxicity_counts(conn)
+
+
+if __name__ == "__main__":
+    main()
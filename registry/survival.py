@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from .calculations import months_between
+from .schema import SCHEMA, has_option
+
+# Endpoints: event flag and interval column, in months from the last radiotherapy
+ENDPOINTS = {
+    "Local recurrence": ("Local_Recurrence", "Time_to_Local_Recurrence"),
+    "Regional recurrence": ("Regional_Recurrence", "Time_to_Regional_Recurrence"),
+    "Distant recurrence": ("Distant_Recurrence", "Time_to_Distant_Recurrence"),
+    "Overall survival": ("Death", "Time_to_Death"),
+}
+STRATA_COLUMNS = ["Histology", "Grade", "Location", "Systemic_Treatment"]
+
+CENSORED, EVENT, COMPETING = 0, 1, 2
+
+
+# Time (months) and status for one endpoint, one row per patient of an encoded
+# current-state frame. Patients without the event are censored at their
+# follow-up; for recurrence endpoints, death without that recurrence is a
+# competing event. Patients with no usable time are dropped.
+def endpoint_data(current, endpoint):
+    flag, interval = ENDPOINTS[endpoint]
+    follow_up = current["Follow_up_time"].fillna(
+        months_between(current["Date_of_Last_Radiotherapy"], current["Follow_up_date"])
+    )
+    event = current[flag] == "Yes"
+    time = follow_up.where(~event, current[interval])
+    status = pd.Series(np.where(event, EVENT, CENSORED), index=current.index)
+    if flag != "Death":
+        died = ~event & (current["Death"] == "Yes") & current["Time_to_Death"].notna()
+        time = time.where(~died, current["Time_to_Death"])
+        status = status.where(~died, COMPETING)
+    data = pd.DataFrame({"time": time, "status": status})
+    return data[data["time"].notna() & (data["time"] >= 0)]
+
+
+# Event and censoring counts at each distinct time, vectorized with np.unique
+def _risk_table(time, status):
+    times, inverse = np.unique(np.asarray(time, dtype=float), return_inverse=True)
+    status = np.asarray(status)
+    removed = np.bincount(inverse, minlength=len(times))
+    at_risk = len(status) - np.concatenate([[0], np.cumsum(removed)[:-1]])
+    counts = {code: np.bincount(inverse, weights=status == code, minlength=len(times)) for code in (EVENT, COMPETING)}
+    return times, at_risk, counts[EVENT], counts[COMPETING], removed
+
+
+# Kaplan-Meier estimate with Greenwood 95% confidence limits. Competing events
+# are treated as censoring.
+def kaplan_meier(time, status):
+    times, at_risk, events, _, removed = _risk_table(time, status)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        survival = np.cumprod(1 - events / at_risk)
+        greenwood = np.cumsum(events / (at_risk * (at_risk - events)))
+    standard_error = survival * np.sqrt(np.nan_to_num(greenwood, posinf=np.nan))
+    return pd.DataFrame({
+        "time": np.concatenate([[0.0], times]),
+        "at_risk": np.concatenate([[len(status)], at_risk]),
+        "events": np.concatenate([[0], events]).astype(int),
+        "censored": np.concatenate([[0], removed - events]).astype(int),
+        "estimate": np.concatenate([[1.0], survival]),
+        "lower": np.concatenate([[1.0], np.clip(survival - 1.96 * standard_error, 0, 1)]),
+        "upper": np.concatenate([[1.0], np.clip(survival + 1.96 * standard_error, 0, 1)]),
+    })
+
+
+# Aalen-Johansen cumulative incidence of the event in the presence of the
+# competing event
+def cumulative_incidence(time, status):
+    times, at_risk, events, competing, removed = _risk_table(time, status)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        survival = np.cumprod(1 - (events + competing) / at_risk)
+        hazard = events / at_risk
+    survival_before = np.concatenate([[1.0], survival[:-1]])
+    incidence = np.cumsum(survival_before * hazard)
+    return pd.DataFrame({
+        "time": np.concatenate([[0.0], times]),
+        "at_risk": np.concatenate([[len(status)], at_risk]),
+        "events": np.concatenate([[0], events]).astype(int),
+        "competing": np.concatenate([[0], competing]).astype(int),
+        "censored": np.concatenate([[0], removed - events - competing]).astype(int),
+        "estimate": np.concatenate([[0.0], incidence]),
+    })
+
+
+# Boolean masks of the patients in each stratum. A multiselect column gives
+# one stratum per option, so a patient can fall into several.
+def strata(current, column=None):
+    if column is None:
+        return {"All patients": pd.Series(True, index=current.index)}
+    field = SCHEMA[column]
+    if field.kind == "multi":
+        masks = {option: has_option(current[column], column, option) for option in field.options}
+    else:
+        masks = {option: current[column] == option for option in field.options}
+    return {label: mask for label, mask in masks.items() if mask.any()}
+
+
+# Curves of one endpoint for each stratum, in long format for plotting
+def survival_curves(current, endpoint, stratify_by=None, estimator="Kaplan-Meier"):
+    data = endpoint_data(current, endpoint)
+    estimate = kaplan_meier if estimator == "Kaplan-Meier" else cumulative_incidence
+    curves = []
+    for label, mask in strata(current, stratify_by).items():
+        subset = data[mask.reindex(data.index, fill_value=False)]
+        if len(subset):
+            curves.append(estimate(subset["time"], subset["status"]).assign(stratum=label))
+    if not curves:
+        return pd.DataFrame(columns=["time", "at_risk", "events", "censored", "estimate", "stratum"])
+    return pd.concat(curves, ignore_index=True)
@@ -0,0 +1,148 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-phase timing of the app's hot paths. Every phase appends one JSON line to
+# `log_file` and is folded into the histograms written, in the Prometheus text
+# format, to `metrics_file` (for node_exporter's textfile collector or any
+# scraper). Set REGISTRY_TELEMETRY=0 to switch it off.
+log_file = os.environ.get("REGISTRY_TELEMETRY_LOG", "telemetry.jsonl")
+metrics_file = os.environ.get("REGISTRY_TELEMETRY_METRICS", "telemetry.prom")
+profile_dir = "profiles"
+enabled = os.environ.get("REGISTRY_TELEMETRY", "1") != "0"
+
+# Histogram bucket bounds in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+_lock = threading.Lock()
+_local = threading.local()
+_histograms = {}
+_gauges = {}
+
+
+# Resident set size in MB: current on Linux, peak elsewhere
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if os.uname().sysname == "Darwin" else peak / 2**10
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def _observe(phase, seconds):
+    with _lock:
+        histogram = _histograms.setdefault(phase, {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)})
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][position] += 1
+
+
+def _log(record):
+    with _lock, open(log_file, "a") as log:
+        log.write(json.dumps(record, default=str) + "\n")
+
+
+# Time one phase of a rerun, e.g. `with phase("save_data", visits=n):`. Extra
+# labels go into the log record. Memory is the process RSS after the phase and,
+# when tracemalloc is tracing, the peak Python allocation during it.
+@contextmanager
+def phase(name, **labels):
+    if not enabled:
+        yield
+        return
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _local.depth = depth
+        record = {"time": time.time(), "phase": name, "seconds": round(seconds, 6), "rss_mb": rss_mb(), **labels}
+        if tracemalloc.is_tracing():
+            record["peak_allocated_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        if error:
+            record["error"] = error
+        _observe(name, seconds)
+        _log(record)
+        # Nested phases are flushed with the phase that contains them
+        if depth == 0:
+            write_metrics()
+
+
+def _format(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+# Write every histogram and gauge to `metrics_file`, replacing it atomically
+def write_metrics(path=None):
+    path = path or metrics_file
+    with _lock:
+        lines = [
+            "# HELP registry_phase_seconds Wall time of app phases",
+            "# TYPE registry_phase_seconds histogram",
+        ]
+        for name, histogram in sorted(_histograms.items()):
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f'registry_phase_seconds_bucket{{phase="{name}",le="{_format(bound)}"}} {count}')
+            lines.append(f'registry_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'registry_phase_seconds_sum{{phase="{name}"}} {histogram["sum"]}')
+            lines.append(f'registry_phase_seconds_count{{phase="{name}"}} {histogram["count"]}')
+        gauges = dict(_gauges, registry_process_rss_mb=rss_mb())
+        for name, value in sorted(gauges.items()):
+            if value is not None:
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    temporary = path + ".tmp"
+    with open(temporary, "w") as metrics:
+        metrics.write("\n".join(lines) + "\n")
+    os.replace(temporary, path)
+
+
+# cProfile capture of a block, dumped to `profile_dir` as <name>.prof for
+# snakeviz or pstats. Only one profiler can run at a time, so a capture that
+# would overlap another one is skipped.
+_profiling = threading.Lock()
+
+
+@contextmanager
+def profile(name):
+    if not _profiling.acquire(blocking=False):
+        yield None
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+    finally:
+        _profiling.release()
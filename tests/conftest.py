@@ -0,0 +1,12 @@
+import pytest
+
+from registry import storage
+
+
+# Every test gets an empty registry database in its own directory, and its own writer
+@pytest.fixture(autouse=True)
+def registry_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "database_file", str(tmp_path / "registry.sqlite3"))
+    yield storage.database_file
+    storage._writers.clear()
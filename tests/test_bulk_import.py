@@ -0,0 +1,43 @@
+import io
+
+from registry.bulk_import import import_file
+from registry.storage import _open, load_visits, save_data
+
+CSV = """MRN,Mytotic Count,Dose_per_Fraction,Histology,Biopsy date,Grade
+1,3,2.5,Liposarcoma,2020-01-05,I
+2,12,2,"['Liposarcoma', 'Myxofibrosarcoma']",2020-02-01 00:00:00,bogus
+3,many,N/A,,not a date,II
+"""
+
+
+def _import(text, **kwargs):
+    return import_file(io.StringIO(text), name="extract.csv", **kwargs)
+
+
+def test_values_are_stored_with_the_form_types():
+    report = _import(CSV)
+    assert report["imported"] == 3
+    visits = load_visits().set_index("MRN")
+    assert visits.at["1", "Mytotic_Count"] == 3 and visits.at["1", "Dose_per_Fraction"] == 2.5
+    assert visits.at["1", "Histology"] == ["Liposarcoma"]
+    assert visits.at["2", "Histology"] == ["Liposarcoma", "Myxofibrosarcoma"]
+    assert visits.at["2", "Biopsy_date"] == "2020-02-01"
+    # Values that do not parse are kept as they were, and reported
+    assert visits.at["3", "Mytotic_Count"] == "many" and visits.at["3", "Biopsy_date"] == "not a date"
+    assert sorted(report["problems"]["column"]) == ["Biopsy_date", "Grade", "Mytotic_Count"]
+
+
+def test_saving_the_same_values_from_the_form_stores_no_delta():
+    _import(CSV)
+    visit_id = save_data({
+        "MRN": "1", "Mytotic_Count": 3, "Dose_per_Fraction": 2.5, "Histology": ["Liposarcoma"],
+        "Biopsy_date": "2020-01-05", "Grade": "I",
+    })
+    with _open() as conn:
+        assert conn.execute("SELECT data FROM visits WHERE id = ?", (visit_id,)).fetchone()[0] == '{"MRN": "1"}'
+
+
+def test_problem_rows_are_numbered_across_csv_chunks():
+    rows = "".join(f"{number},{'bogus' if number in (6, 9) else 'I'}\n" for number in range(12))
+    report = _import("MRN,Grade\n" + rows, size=4)
+    assert report["problems"]["row"].tolist() == [6, 9]
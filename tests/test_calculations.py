@@ -0,0 +1,34 @@
+from registry.calculations import derived_updates
+from registry.storage import load_visits, rewrite_visits, save_data
+
+BASE = {"Date_of_Birth": "1960-03-15", "Date_of_Last_Radiotherapy": "2020-01-10"}
+
+
+def test_intervals_are_recomputed_only_from_event_dates():
+    # Saved before event dates were recorded: the stored interval is kept
+    legacy = save_data({"MRN": "1", **BASE, "Local_Recurrence": "Yes", "Time_to_Local_Recurrence": 8})
+    # Event date present: the interval is recomputed from it
+    dated = save_data({
+        "MRN": "2", **BASE, "Local_Recurrence": "Yes", "Local_Recurrence_date": "2020-09-01",
+        "Time_to_Local_Recurrence": 3,
+    })
+    # No event: a stale interval is cleared
+    cleared = save_data({"MRN": "3", **BASE, "Death": "No", "Time_to_Death": 5})
+
+    updates = derived_updates(load_visits())
+    assert legacy not in updates
+    assert updates[dated] == {"Time_to_Local_Recurrence": 8}
+    assert updates[cleared] == {"Time_to_Death": "N/A"}
+
+
+def test_age_needs_both_dates_and_repeated_runs_are_stable():
+    no_follow_up = save_data({"MRN": "1", **BASE, "Age": 61})
+    no_birth_date = save_data({"MRN": "2", "Follow_up_date": "2021-01-01", "Age": 61})
+    with_dates = save_data({"MRN": "3", **BASE, "Follow_up_date": "2021-03-14", "Age": 61})
+
+    updates = derived_updates(load_visits())
+    assert no_follow_up not in updates and no_birth_date not in updates
+    assert updates[with_dates] == {"Age": 60, "Follow_up_time": 14}
+
+    rewrite_visits(updates)
+    assert derived_updates(load_visits()) == {}
@@ -0,0 +1,17 @@
+import csv
+import io
+
+from registry.export import export
+from registry.storage import save_many
+
+
+def test_date_window_filters_on_follow_up_date_by_default():
+    save_many([
+        {"MRN": "1", "Age": 60, "Follow_up_date": "2015-06-01"},
+        {"MRN": "2", "Age": 61, "Follow_up_date": "2017-06-01"},
+    ])
+    out = io.BytesIO()
+    report = export(out, "csv", columns=["Age"], start="2016-01-01")
+    rows = list(csv.DictReader(io.StringIO(out.getvalue().decode())))
+    assert report["rows"] == 1
+    assert rows == [{"visit_id": "2", "MRN": "2", "Age": "61"}]
@@ -0,0 +1,92 @@
+import json
+import time
+from datetime import datetime
+
+from benchmark import synthetic_registry
+from registry.storage import (
+    Registry, audit_trail, iter_visits, load_current, load_visits, merge_state, normalize_mrn, record_visits,
+    rewrite_visits, save_data, state_at, transaction,
+)
+
+
+# Full state of each patient after each row, as the registry should read it back
+def expected_states(rows):
+    states, expected = {}, []
+    for row in rows:
+        row = json.loads(json.dumps(row))
+        mrn = normalize_mrn(row["MRN"])
+        states[mrn] = merge_state(states.get(mrn), row)
+        expected.append(states[mrn])
+    return expected
+
+
+def _present(row):
+    return {key: value for key, value in row.items() if value is not None and value == value}
+
+
+def test_replayed_deltas_equal_saved_rows():
+    rows = synthetic_registry(1500)
+    with transaction() as conn:
+        record_visits(conn, rows[:1000])
+    for row in rows[1000:1050]:
+        save_data(dict(row), author="tester")
+    with transaction() as conn:
+        record_visits(conn, rows[1050:])
+    expected = expected_states(rows)
+
+    assert [_present(row) for row in load_visits().to_dict("records")] == expected
+    assert [row for chunk in iter_visits(size=97) for _, row in chunk] == expected
+    assert [row for chunk in iter_visits(since=700, size=64) for _, row in chunk] == expected[700:]
+    registry = Registry().refresh()
+    assert registry.lookup(rows[0]["MRN"]) == [
+        state for row, state in zip(rows, expected) if row["MRN"] == rows[0]["MRN"]
+    ]
+
+
+def test_visit_numbers_count_each_patients_visits():
+    rows = synthetic_registry(300)
+    with transaction() as conn:
+        record_visits(conn, rows)
+    seen = {}
+    for chunk in iter_visits(since=50, size=40, numbered=True):
+        for _, number, row in chunk:
+            mrn = row["MRN"]
+            seen[mrn] = seen.get(mrn, sum(1 for earlier in rows[:50] if earlier["MRN"] == mrn)) + 1
+            assert number == seen[mrn]
+
+
+def test_rewrite_keeps_original_entries_and_records_corrections():
+    first = save_data({"MRN": "1", "Location": "Trunk", "Age": 50}, author="alice")
+    save_data({"MRN": "1", "Nausea": "I"}, author="bob")
+    time.sleep(0.01)
+    before = datetime.now()
+    time.sleep(0.01)
+    rewrite_visits({first: {"Location": "Extremity"}}, author="fixer")
+
+    trail = audit_trail("1")
+    saved = trail[trail["change"] == "saved"]
+    corrected = trail[trail["change"] == "corrected"]
+    assert saved[["author", "column", "value"]].values.tolist() == [
+        ["alice", "Location", "Trunk"], ["alice", "Age", "50"], ["bob", "Nausea", "I"],
+    ]
+    assert corrected[["visit_id", "author", "column", "value"]].values.tolist() == [
+        [first, "fixer", "Location", "Extremity"],
+    ]
+    assert state_at("1", before) == {"MRN": "1", "Location": "Trunk", "Age": 50, "Nausea": "I"}
+    assert load_visits().loc[first, "Location"] == "Extremity"
+    # The later visit did not store Location, so it follows the correction
+    assert load_current().set_index("MRN").loc["1", "Location"] == "Extremity"
+    assert Registry().current("1")["Location"] == "Extremity"
+
+
+def test_rewrite_leaves_unchanged_visits_alone():
+    with transaction() as conn:
+        record_visits(conn, synthetic_registry(300))
+    locations = load_visits()["Location"].dropna()
+    with transaction() as conn:
+        stored = conn.execute("SELECT id, data FROM visits ORDER BY id").fetchall()
+    rewrite_visits({visit_id: {"Location": location} for visit_id, location in locations.items()})
+
+    with transaction() as conn:
+        assert conn.execute("SELECT id, data FROM visits ORDER BY id").fetchall() == stored
+        assert conn.execute("SELECT COUNT(*) FROM corrections").fetchone() == (0,)
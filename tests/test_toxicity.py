@@ -0,0 +1,48 @@
+import random
+
+from benchmark import synthetic_registry
+from registry import storage
+from registry.storage import load_toxicity_counts, rebuild_toxicity_counts, record_visits, save_data, save_many, transaction
+
+
+def _counts():
+    with storage._open() as conn:
+        return sorted(conn.execute("SELECT toxicity, grade, regimen, location, patients FROM toxicity_counts"))
+
+
+def test_incremental_counts_match_rebuild():
+    rows = synthetic_registry(1200)
+    rng = random.Random(1)
+    with transaction() as conn:
+        record_visits(conn, rows[:800])
+    for row in rows[800:850]:
+        save_data(dict(row))
+    # Patients moving to another regimen or location leave their old counts
+    for _ in range(30):
+        row = dict(rng.choice(rows), Location=rng.choice(["Trunk", "Other"]), Dose_per_Fraction=5)
+        save_data(row)
+    save_many([dict(row) for row in rows[850:]])
+
+    incremental = _counts()
+    with transaction() as conn:
+        rebuild_toxicity_counts(conn)
+    assert incremental == _counts()
+    assert sum(count for *_, count in incremental) > 0
+
+
+def test_worst_grade_is_kept_when_the_toxicity_resolves():
+    save_data({"MRN": "1", "Fatigue": "None", "Dose_per_Fraction": 2, "Fractionation": 25, "Location": "Trunk"})
+    save_data({"MRN": "1", "Fatigue": "II"})
+    save_data({"MRN": "1", "Fatigue": "None"})
+    assert load_toxicity_counts().values.tolist() == [["Fatigue", "II", "2 Gy x 25", "Trunk", 1]]
+
+
+def test_present_ranks_above_absent():
+    # Dysuria's options list "Present" before "Absent"; Ureteral_Stenosis the other way round
+    save_data({"MRN": "1", "Dysuria": "Present", "Ureteral_Stenosis": "Present", "Location": "Trunk"})
+    save_data({"MRN": "1", "Dysuria": "Absent", "Ureteral_Stenosis": "Absent"})
+    save_data({"MRN": "2", "Dysuria": "Absent", "Location": "Trunk"})
+    counts = load_toxicity_counts()
+    assert sorted(counts[["toxicity", "grade", "patients"]].values.tolist()) == [
+        ["Dysuria", "Absent", 1], ["Dysuria", "Present", 1], ["Ureteral_Stenosis", "Present", 1],
+    ]